@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+# End-to-end benchmark of the acquisition -> storage -> render pipeline.
+# Synthetic serial lines are fed through Arduino.getData on the reader
+# thread at increasing rates, recorded by the SQLite writer and drawn by
+# the graphs (when PySide is available). Each rate runs in a process of
+# its own, so its memory figures aren't those of the runs before it.
+# Results, with a per-second timeline of memory and frame times, are
+# saved as JSON and can be compared against an earlier run:
+#
+#     python benchmark.py --rates 10 100 1000 --duration 10
+#     python benchmark.py --compare bench-old.json
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import subprocess
+import resource
+import tempfile
+import argparse
+from core import *
+
+frame_interval = 0.1
+mean_interval = 2.0
+timeline_interval = 1.0
+
+class Stage():
+    def __init__(self):
+        self.times = []
+        # Where the current timeline interval starts in self.times
+        self.mark = 0
+
+    def time(self, f, *args):
+        start = time.time()
+        result = f(*args)
+        self.times.append(time.time() - start)
+        return result
+
+    def wrap(self, obj, name):
+        # Times every call of obj.name, whichever thread makes it
+        original = getattr(obj, name)
+        def timed(*args):
+            return self.time(original, *args)
+        setattr(obj, name, timed)
+
+    def since(self):
+        # p50 and max in ms of the calls since the last timeline point
+        times = np.array(self.times[self.mark:]) * 1000.0
+        self.mark = len(self.times)
+        if not len(times):
+            return None, None
+        return float(np.percentile(times, 50)), float(times.max())
+
+    def summary(self):
+        if not self.times:
+            return {'count' : 0}
+        times = np.array(self.times) * 1000.0
+        return {
+            'count' : len(times),
+            'mean_ms' : float(times.mean()),
+            'p50_ms' : float(np.percentile(times, 50)),
+            'p90_ms' : float(np.percentile(times, 90)),
+            'p99_ms' : float(np.percentile(times, 99)),
+            'max_ms' : float(times.max())
+        }
+
+class SyntheticSerial():
+    # Stands in for serial.Serial: readline() hands out lines at `rate`
+    def __init__(self, rate):
+        self.period = 1.0 / rate
+        self.start = time.time()
+        self.sent = 0
+        self.running = True
+
+    def readline(self):
+        due = self.start + self.sent * self.period
+        wait = due - time.time()
+        if wait > 0:
+            time.sleep(min(wait, delta_t))
+            if wait > delta_t:
+                return ''
+        if not self.running:
+            return ''
+        i = self.sent
+        self.sent += 1
+        return '%.1f,%.2f,%.2f\r\n' %(20 + (i % 100) * 0.01, 1013.25 + (i % 50) * 0.01, i % 3000)
+
+    def close(self):
+        pass
+
+class SyntheticArduino(Arduino):
+    def __init__(self, rate):
+        Arduino.__init__(self, name='bench', connect=False)
+        self.NP = 'bench'
+        self.comStatus = True
+        self.linkState = 'connected'
+        self.arduino = SyntheticSerial(rate)
+
+def peakRSS():
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss
+
+def currentRSS():
+    # Resident set in kB where /proc has it, otherwise the peak so far
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024
+    except (IOError, OSError):
+        return peakRSS()
+
+def openGraphs(stream):
+    try:
+        from PySide import QtGui
+    except ImportError:
+        return None, None, None
+    app = QtGui.QApplication.instance() or QtGui.QApplication(sys.argv)
+    import main
+    main.stream = stream
+    graphs = [main.ChannelGraph(None, channel) for channel in registry]
+    for graph in graphs:
+        graph.resize(800, 400)
+        graph.show()
+    return app, main, graphs
+
+def closeGraphs(graphs):
+    for graph in graphs:
+        graph.close()
+
+class DataSide():
+    # The Qt-free half of update() when the graphs can't be drawn
+    def __init__(self, stream):
+        self.frames = stream.frames
+        self.names = channelNames()
+        self.lods = [MinMaxPyramid(self.frames, name) for name in self.names]
+        self.stats = [ChannelStats(quantiles=channelIndex[name].mean) for name in self.names]
+
+    def update(self, fresh):
+        for lod, stats in zip(self.lods, self.stats):
+            lod.update()
+            stats.extend(self.frames.recent(lod.name, fresh))
+
+def run(rate, duration, directory):
+    stages = dict([(name, Stage()) for name in ('frame', 'parse', 'journal', 'drain', 'alarms', 'update', 'meanUpdate', 'render', 'paint', 'addRecords')])
+
+    source = SyntheticArduino(rate)
+    stages['parse'].wrap(source, 'parse')
+    source.journal = Journal(os.path.join(directory, 'journal-%d' %(rate)))
+    stages['journal'].wrap(source.journal, 'append')
+    stream = SampleStream(source)
+    path = os.path.join(directory, 'bench-%d.db' %(rate))
+    sqlite = SQLite(stream.subscribe(), path=path)
+    alarms = AlarmEngine(alarm_rules)
+    stages['addRecords'].wrap(sqlite, 'addRecords')
+
+    app, gui, graphs = openGraphs(stream)
+    if graphs is None:
+        dataSide = DataSide(stream)
+
+    sqlite.start()
+    stream.start()
+    start = time.time()
+    nextMean = start + mean_interval
+    nextPoint = start + timeline_interval
+    timeline = []
+    received = 0
+    while time.time() - start < duration:
+        frame = time.time()
+        if frame >= nextPoint:
+            framePercentile, frameMax = stages['frame'].since()
+            updatePercentile, updateMax = stages['update'].since()
+            timeline.append({
+                't_s' : frame - start,
+                'rss_kb' : currentRSS(),
+                'received' : received,
+                'frame_p50_ms' : framePercentile,
+                'frame_max_ms' : frameMax,
+                'update_p50_ms' : updatePercentile,
+                'update_max_ms' : updateMax
+            })
+            nextPoint += timeline_interval
+        batch = stages['drain'].time(stream.drain)
+        received += len(batch)
+        for event in stages['alarms'].time(alarms.update, stream):
+            sqlite.alarm(event)
+        if graphs is None:
+            stages['update'].time(dataSide.update, stream.fresh)
+        else:
+            for graph in graphs:
+                stages['update'].time(gui.update, graph)
+            if frame >= nextMean:
+                for graph in graphs:
+                    if graph.channel.mean:
+                        stages['meanUpdate'].time(gui.meanUpdate, graph)
+                nextMean += mean_interval
+            stages['render'].time(gui.scheduler.flush)
+            stages['paint'].time(app.processEvents)
+        stages['frame'].times.append(time.time() - frame)
+        time.sleep(max(0.0, frame_interval - (time.time() - frame)))
+
+    elapsed = time.time() - start
+    source.arduino.running = False
+    stream.stop()
+    received += len(stream.drain())
+    sqlite.stop()
+    if graphs is not None:
+        closeGraphs(graphs)
+
+    records = Records(path)
+    recorded = len(records.query(records.lastSession(), channels=['temp'])[0])
+    records.close()
+
+    sent = source.arduino.sent
+    return {
+        'rate' : rate,
+        'duration_s' : elapsed,
+        'sent' : sent,
+        'received' : received,
+        'recorded' : recorded,
+        'dropped' : sent - min(received, recorded),
+        'throughput' : recorded / elapsed,
+        'peak_rss_kb' : peakRSS(),
+        'gui' : graphs is not None,
+        'stages' : dict([(name, stage.summary()) for name, stage in stages.items()]),
+        'timeline' : timeline
+    }
+
+def runIsolated(rate, duration, directory):
+    # One child process per rate; it leaves its result in the directory
+    path = os.path.join(directory, 'result-%g.json' %(rate))
+    subprocess.check_call([sys.executable, os.path.abspath(__file__), '--rates', repr(rate),
+                           '--duration', repr(duration), '--child', directory])
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def compare(old, new):
+    print '%8s %-12s %12s %12s' %('rate', 'stage p99', 'old ms', 'new ms')
+    oldRuns = dict([(r['rate'], r) for r in old['runs']])
+    for r in new['runs']:
+        o = oldRuns.get(r['rate'])
+        if o is None:
+            continue
+        for name, stage in sorted(r['stages'].items()):
+            if stage['count'] and o['stages'].get(name, {}).get('count'):
+                print '%8g %-12s %12.3f %12.3f' %(r['rate'], name, o['stages'][name]['p99_ms'], stage['p99_ms'])
+        print '%8g %-12s %12.1f %12.1f' %(r['rate'], 'samples/s', o['throughput'], r['throughput'])
+        print '%8g %-12s %12d %12d' %(r['rate'], 'peak RSS kB', o['peak_rss_kb'], r['peak_rss_kb'])
+
+def report(result):
+    print '%g Hz: %d sent, %d recorded, %d dropped, %.1f samples/s, peak RSS %d kB' \
+        %(result['rate'], result['sent'], result['recorded'], result['dropped'],
+          result['throughput'], result['peak_rss_kb'])
+    for name, stage in sorted(result['stages'].items()):
+        if stage['count']:
+            print '    %-12s n=%-8d p50 %.3f ms  p99 %.3f ms  max %.3f ms' \
+                %(name, stage['count'], stage['p50_ms'], stage['p99_ms'], stage['max_ms'])
+    timeline = result.get('timeline')
+    if timeline:
+        first, last = timeline[0], timeline[-1]
+        print '    over %.0f s: RSS %d -> %d kB, frame p50 %s -> %s ms' \
+            %(last['t_s'] - first['t_s'], first['rss_kb'], last['rss_kb'],
+              '%.3f' %(first['frame_p50_ms']) if first['frame_p50_ms'] is not None else '-',
+              '%.3f' %(last['frame_p50_ms']) if last['frame_p50_ms'] is not None else '-')
+    sys.stdout.flush()
+
+def parseOptions(argv):
+    parser = argparse.ArgumentParser(prog='benchmark')
+    parser.add_argument('--rates', type=float, nargs='+', default=[10, 100, 1000, 5000], help='lines per second')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per rate')
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--compare', metavar='JSON', help='earlier results to compare against')
+    parser.add_argument('--child', metavar='DIR', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv):
+    options = parseOptions(argv)
+    if options.child:
+        rate = options.rates[0]
+        result = run(rate, options.duration, options.child)
+        with open(os.path.join(options.child, 'result-%g.json' %(rate)), 'w') as f:
+            json.dump(result, f)
+        return
+
+    directory = tempfile.mkdtemp(prefix='8space-bench-')
+    results = {
+        'version' : VERSION,
+        'date' : time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'runs' : []
+    }
+    try:
+        for rate in options.rates:
+            result = runIsolated(rate, options.duration, directory)
+            report(result)
+            results['runs'].append(result)
+    finally:
+        shutil.rmtree(directory, True)
+
+    output = options.output or 'bench-%s-%s.json' %(VERSION, time.strftime('%Y%m%d-%H%M%S'))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print 'Saved %s' %(output)
+
+    if options.compare:
+        with open(options.compare, 'r') as f:
+            compare(json.load(f), results)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
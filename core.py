@@ -0,0 +1,2298 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import sys
+import glob
+import mmap
+import time
+import zlib
+import struct
+import shutil
+import zipfile
+import tempfile
+import math
+import bisect
+import itertools
+import collections
+import argparse
+import logging
+import logging.handlers
+import threading
+import Queue
+import BaseHTTPServer
+import sqlite3
+import serial
+import serial.tools.list_ports
+import numpy as np
+
+VERSION = '1.0.0'
+delta_t = 0.1
+chunk_size = 150000
+spill_evicted = False
+lod_factor = 4
+stats_window = 600
+ewma_alpha = 0.05
+db_batch_size = 500
+db_commit_interval = 1.0
+db_session_gap = 60
+db_path = 'cansat-records-strv%s.db' %(VERSION)
+# A field that didn't parse; left out of statistics, rates and estimates
+# and stored as NULL
+missing_value = float('nan')
+p0 = 101325.0
+link_backoff_max = 5.0
+link_scan_interval = 5.0
+log_path = 'cansat-strv%s.log' %(VERSION)
+log_ring_size = 10000
+log_collapse_period = 3.0
+log_max_bytes = 1024 * 1024
+log_backups = 3
+journal_dir = 'journal'
+journal_segment_size = 16 * 1024 * 1024
+journal_sync_interval = 1.0
+metrics_buckets = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+class Globals():
+    temp = 0.1
+    press = 0.1
+    poll = 0.1
+    alt = 0.0
+    vspeed = 0.0
+    pollRate = 0.0
+    estAlt = 0.0
+    estSpeed = 0.0
+    estSigma = 0.0
+
+# ----------------------------------------------------------------------
+# Utils
+# ----------------------------------------------------------------------
+
+class LogWriter(threading.Thread):
+    # Copies log lines into a rotating file off the caller's thread
+    def __init__(self, path, maxBytes=log_max_bytes, backups=log_backups):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = Queue.Queue()
+        self.handler = logging.handlers.RotatingFileHandler(path, maxBytes=maxBytes, backupCount=backups)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+
+    def run(self):
+        while True:
+            line = self.queue.get()
+            if line is None:
+                break
+            self.handler.emit(logging.makeLogRecord({'msg' : line}))
+        self.handler.close()
+
+    def stop(self):
+        self.queue.put(None)
+        if self.is_alive():
+            self.join(2.0)
+
+class LogSink():
+    # Messages from any thread go into a bounded ring. A message repeated
+    # within `period` of its first appearance is shown once, followed by a
+    # count when the period is over. Readers pick up what is new with
+    # since(); echo and the optional file get every shown line.
+    def __init__(self, size=log_ring_size, period=log_collapse_period, echo=sys.__stdout__):
+        self.period = period
+        self.echo = echo
+        self.lock = threading.Lock()
+        self.ring = collections.deque(maxlen=size)
+        self.seq = 0
+        # {message: [first seen, count]}, oldest first
+        self.recent = collections.OrderedDict()
+        self.partial = {}
+        self.writer = None
+
+    def open(self, path=log_path):
+        self.writer = LogWriter(path)
+        self.writer.start()
+
+    def close(self):
+        self.expire(float('inf'))
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+
+    def write(self, text):
+        # File-like, for print and stdout redirection: lines are completed
+        # per thread before they count as messages
+        thread = threading.current_thread().ident
+        text = self.partial.pop(thread, '') + text
+        lines = text.split('\n')
+        if lines[-1]:
+            self.partial[thread] = lines[-1]
+        for line in lines[:-1]:
+            self.message(line)
+
+    def flush(self):
+        pass
+
+    def message(self, text):
+        now = time.time()
+        with self.lock:
+            self.expireLocked(now)
+            seen = self.recent.get(text)
+            if seen is not None:
+                seen[1] += 1
+                return
+            self.recent[text] = [now, 1]
+            self.append('%s %s' %(time.strftime('%H:%M:%S', time.localtime(now)), text))
+
+    def expire(self, now=None):
+        with self.lock:
+            self.expireLocked(time.time() if now is None else now)
+
+    def expireLocked(self, now):
+        while self.recent:
+            text, (first, count) = next(self.recent.iteritems())
+            if now - first < self.period:
+                break
+            del self.recent[text]
+            if count > 1:
+                self.append('%s %s (repeated %d times)' %(time.strftime('%H:%M:%S'), text, count - 1))
+
+    def append(self, line):
+        self.seq += 1
+        self.ring.append((self.seq, line))
+        if self.echo is not None:
+            self.echo.write(line + '\n')
+        if self.writer is not None:
+            self.writer.queue.put(line)
+
+    def since(self, seq):
+        # (last seq, lines after seq); lines that already left the ring
+        # are reported as a count
+        with self.lock:
+            self.expireLocked(time.time())
+            if not self.ring or self.ring[-1][0] <= seq:
+                return seq, []
+            lines = [line for n, line in self.ring if n > seq]
+            missed = self.ring[0][0] - seq - 1
+            if missed > 0:
+                lines.insert(0, '... %d lines not shown' %(missed))
+            return self.seq, lines
+
+log = LogSink()
+
+class Backoff():
+    # Exponentially growing waits between attempts, capped at `limit`
+    def __init__(self, first=delta_t, limit=link_backoff_max, factor=2.0):
+        self.first = first
+        self.limit = limit
+        self.factor = factor
+        self.reset()
+
+    def reset(self):
+        self.wait = self.first
+
+    def next(self):
+        wait = self.wait
+        self.wait = min(self.wait * self.factor, self.limit)
+        return wait
+
+# ----------------------------------------------------------------------
+# Metrics
+# ----------------------------------------------------------------------
+
+class Counter():
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+class Gauge():
+    kind = 'gauge'
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+class Histogram():
+    # Fixed buckets, so an observation costs one bisect whatever the count
+    kind = 'histogram'
+
+    def __init__(self, buckets=metrics_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation, None
+        # before anything was observed
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+class Metrics():
+    # Series are keyed by name and labels and made on first use. Updates
+    # take no lock, so every series must have a single writing thread:
+    # per-source series carry a source label (one reader thread each),
+    # the rest belong to the drain, writer or GUI thread alone.
+    def __init__(self):
+        self.series = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def get(self, kind, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        series = self.series.get(key)
+        if series is None:
+            with self.lock:
+                series = self.series.setdefault(key, kind())
+        return series
+
+    def counter(self, name, **labels):
+        return self.get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self.get(Gauge, name, labels)
+
+    def histogram(self, name, **labels):
+        return self.get(Histogram, name, labels)
+
+    def timed(self, name, **labels):
+        # Decorator recording each call's duration in seconds
+        histogram = self.histogram(name, **labels)
+        def wrap(f):
+            def timed(*args, **kwargs):
+                start = time.time()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    histogram.observe(time.time() - start)
+            return timed
+        return wrap
+
+    def items(self):
+        # Sorted, so the series of one name come together
+        with self.lock:
+            return sorted(self.series.items())
+
+    def rows(self):
+        # (series, kind, value or count, per second, p50, p99) for display
+        elapsed = max(time.time() - self.started, 1e-9)
+        rows = []
+        for (name, labels), series in self.items():
+            label = name + ''.join(['[%s]' %(value) for key, value in labels])
+            if series.kind == 'histogram':
+                rows.append((label, series.kind, series.count, series.count / elapsed,
+                             series.quantile(0.5), series.quantile(0.99)))
+            elif series.kind == 'counter':
+                rows.append((label, series.kind, series.value, series.value / elapsed, None, None))
+            else:
+                rows.append((label, series.kind, series.value, None, None, None))
+        return rows
+
+    def prometheus(self):
+        # Text exposition format, every name prefixed with cansat_
+        lines = []
+        kinds = {}
+        for (name, labels), series in self.items():
+            name = 'cansat_' + name
+            if name not in kinds:
+                kinds[name] = series.kind
+                lines.append('# TYPE %s %s' %(name, series.kind))
+            tags = ['%s="%s"' %(key, value) for key, value in labels]
+            if series.kind != 'histogram':
+                lines.append('%s%s %r' %(name, promLabels(tags), float(series.value)))
+                continue
+            seen = 0
+            for bound, count in zip(series.buckets + (float('inf'),), series.counts):
+                seen += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_bucket%s %d' %(name, promLabels(tags + ['le="%s"' %(le)]), seen))
+            lines.append('%s_sum%s %r' %(name, promLabels(tags), series.sum))
+            lines.append('%s_count%s %d' %(name, promLabels(tags), series.count))
+        return '\n'.join(lines) + '\n'
+
+def promLabels(tags):
+    return '{%s}' %(','.join(tags)) if tags else ''
+
+metrics = Metrics()
+
+class MetricsServer(threading.Thread):
+    # Serves the metrics for monitoring on http://host:port/metrics
+    def __init__(self, port, host='127.0.0.1'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = BaseHTTPServer.HTTPServer((host, port), Handler)
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def serveMetrics(options):
+    # Starts the endpoint when --metrics PORT was given
+    if not options.metrics:
+        return None
+    server = MetricsServer(options.metrics)
+    server.start()
+    log.message('Metrics on http://127.0.0.1:%d/metrics' %(options.metrics))
+    return server
+
+# ----------------------------------------------------------------------
+# Input
+# ----------------------------------------------------------------------
+
+def findPorts(device="Arduino Leonardo"):
+    # COM numbers of every matching device, in enumeration order
+    found = []
+    for port in serial.tools.list_ports.comports():
+        port = str(port)
+        if device in port:
+            found.append(filter(str.isdigit, port.split(' ')[0]))
+    return found
+
+class Arduino():
+    def __init__(self, port=None, name=None, connect=True):
+        # An explicit port (e.g. the simulator's pty) skips the COM scan.
+        # name tags this device's samples and database sessions. Stand-ins
+        # pass connect=False and set up their own link.
+        self.port = port
+        self.NP = port or '-1'
+        self.id = name or (os.path.basename(port) if port else 'arduino')
+        self.data = [missing_value] * len(sensors)
+        self.status = dict.fromkeys(sensorNames(), False)
+        self.fields = [channel.field for channel in sensors]
+        self.debugMode = False
+        self.comStatus = False
+        self.partial = ''
+        self.journal = None
+        self.linkState = 'connecting'
+        self.backoff = Backoff()
+        self.retryAt = 0.0
+        self.scanAt = 0.0
+        if not connect:
+            return
+        try:
+            self.connect()
+            self.comStatus = True
+            self.linkState = 'connected'
+        except Exception as e:
+            print e
+            # Keeps feeding the last data while looking for the device
+            self.debugMode = True
+            self.linkState = 'debug'
+            self.retryAt = time.time() + self.backoff.next()
+
+    def findPort(self, device="Arduino Leonardo"):
+        found = findPorts(device)
+        if found:
+            self.NP = found[0]
+
+    def connect(self, scan=True):
+        if self.port is not None:
+            self.arduino = serial.Serial(self.port, 9600, timeout=delta_t)
+            return
+        if scan or self.NP == '-1':
+            self.findPort()
+        self.arduino = serial.Serial('COM' + self.NP, 9600, timeout=delta_t)
+
+    def present(self):
+        # Cheap hot-plug check before trying to open the port. Device
+        # nodes can be looked for directly; COM ports are simply opened,
+        # and only rescanned every link_scan_interval.
+        if self.port is not None:
+            return not os.path.isabs(self.port) or os.path.exists(self.port)
+        return self.NP != '-1' or time.time() >= self.scanAt
+
+    def lost(self):
+        # Samples already handed out stay queued; only the half line
+        # being read is dropped
+        log.message('00A-Lost signal')
+        metrics.counter('link_lost_total', source=self.id).inc()
+        if self.partial:
+            metrics.counter('serial_lines_dropped_total', source=self.id, reason='lost').inc()
+        self.status = dict.fromkeys(sensorNames(), False)
+        self.comStatus = False
+        self.partial = ''
+        self.linkState = 'lost'
+        try:
+            self.arduino.close()
+        except Exception:
+            pass
+        if self.journal is not None and self.journal.mm is not None:
+            self.journal.sync()
+        self.backoff.reset()
+        self.retryAt = time.time()
+
+    def reconnect(self):
+        # One step of the reconnect state machine; never waits longer than
+        # delta_t so the reader can still be stopped
+        now = time.time()
+        if now < self.retryAt:
+            time.sleep(min(self.retryAt - now, delta_t))
+            return
+        if self.present():
+            scan = now >= self.scanAt
+            if scan:
+                self.scanAt = now + link_scan_interval
+            try:
+                self.connect(scan)
+                self.comStatus = True
+                self.debugMode = False
+                self.linkState = 'connected'
+                self.backoff.reset()
+                log.message('00B-Signal found')
+                return
+            except Exception:
+                pass
+        if not self.debugMode:
+            self.linkState = 'waiting'
+        self.retryAt = time.time() + self.backoff.next()
+
+    def parse(self, output):
+        # One pass over the sensors' CSV fields; a line that doesn't
+        # convert cleanly is redone field by field
+        fields = output.split(',')
+        try:
+            self.data = [float(fields[i]) for i in self.fields]
+            if not all(self.status.itervalues()):
+                self.status = dict.fromkeys(sensorNames(), True)
+            return self.data
+        except (ValueError, IndexError):
+            pass
+
+        # A line cut short may have been cut inside its last field too
+        if len(fields) <= max(self.fields):
+            fields = fields[:-1]
+        data = []
+        status = {}
+        for channel in sensors:
+            try:
+                data.append(float(fields[channel.field]))
+                status[channel.name] = True
+            except (ValueError, IndexError):
+                data.append(missing_value)
+                status[channel.name] = False
+                metrics.counter('parse_failures_total', source=self.id, channel=channel.name).inc()
+        self.status = status
+        self.data = data
+        return self.data
+
+    def now(self):
+        return time.time()
+
+    def getData(self):
+        # Returns a new sample, or None when no complete line is available.
+        # Without a device there is nothing to hand out: placeholders would
+        # be recorded and derived from as if they had been measured.
+        if self.debugMode:
+            if time.time() >= self.retryAt:
+                self.reconnect()
+            if self.debugMode:
+                time.sleep(delta_t)
+                return None
+        if not self.comStatus:
+            self.reconnect()
+            return None
+
+        try:
+            output = self.partial + self.arduino.readline()
+        except Exception:
+            self.lost()
+            return None
+
+        # readline() gives back what it has when the timeout expires
+        if not output.endswith('\n'):
+            self.partial = output
+            return None
+        self.partial = ''
+
+        output = output.strip()
+        metrics.counter('serial_lines_total', source=self.id).inc()
+        if self.journal is not None:
+            self.journal.append(self.now(), output)
+        if len(output) > 2:
+            return self.parse(output)
+        metrics.counter('serial_lines_dropped_total', source=self.id, reason='short').inc()
+        return None
+
+class Replay(Arduino):
+    # Stands in for Arduino, playing back a recorded session (from the
+    # database, a journal run or a capture file of 'epoch<TAB>line' rows) at `speed` times
+    # real time, or as fast as possible when speed is 0. Samples keep their
+    # recorded spacing, shifted to start when the replay starts.
+    def __init__(self, path, session=None, speed=1.0):
+        Arduino.__init__(self, name='replay', connect=False)
+        self.NP = 'replay'
+        self.linkState = 'replay'
+        self.comStatus = True
+        self.path = path
+        self.session = session
+        self.speed = speed
+        self.samples = None
+        self.t = 0.0
+        self.check()
+
+    def check(self):
+        # What can be told about the source is checked here, so a bad
+        # --replay stops the caller instead of the reader thread
+        if not os.path.isfile(self.path):
+            raise ValueError('No replay source at %s' %(self.path))
+        if self.path.endswith('.db'):
+            records = Records(self.path)
+            try:
+                session = self.session if self.session is not None else records.lastSession()
+                if session is None or not records.count(session):
+                    raise ValueError('No recorded samples to replay in %s' %(self.path))
+            finally:
+                records.close()
+        elif self.path.endswith('.journal') and journalRun(self.path) is None:
+            raise ValueError('%s is not named like a journal segment' %(self.path))
+
+    def open(self):
+        # Opened from the reader thread, which then owns the connection
+        if self.path.endswith('.db'):
+            self.samples = self.recorded()
+        elif self.path.endswith('.journal'):
+            self.samples = self.journaled()
+        else:
+            self.samples = self.captured()
+        self.first = None
+
+    def recorded(self):
+        records = Records(self.path)
+        session = self.session
+        if session is None:
+            # The session of this run stays empty until the replay feeds it
+            session = records.lastSession()
+        stored = records.units()
+        # Derived channels are worked out again from the sensors
+        self.status = dict([(name, name in stored) for name in sensorNames()])
+        for t, frames in records.sensorChunks(session):
+            for i in xrange(len(t)):
+                self.data = frames[i].tolist()
+                yield t[i] / 1000000.0, self.data
+        records.close()
+
+    def journaled(self):
+        # Any segment of a run plays the whole run back
+        directory = os.path.dirname(self.path)
+        run = journalRun(self.path)
+        for t, line in readJournal(journalRuns(directory).get(run, [])):
+            if len(line) > 2:
+                yield t, self.parse(line)
+
+    def captured(self):
+        t = 0.0
+        with open(self.path, 'r') as capture:
+            for line in capture:
+                if '\t' in line:
+                    t, line = line.split('\t', 1)
+                    t = float(t)
+                else:
+                    t += delta_t
+                line = line.strip()
+                if len(line) > 2:
+                    yield t, self.parse(line)
+
+    def now(self):
+        return self.base + self.t - self.first
+
+    def getData(self):
+        try:
+            if self.samples is None:
+                self.open()
+            t, data = next(self.samples)
+        except StopIteration:
+            if self.comStatus:
+                log.message('00D-Replay finished')
+            self.comStatus = False
+            time.sleep(delta_t)
+            return None
+        except Exception as e:
+            # e.g. a malformed capture line; the replay ends there
+            if self.comStatus:
+                log.message('00E-Replay stopped: %s' %(e))
+            self.comStatus = False
+            self.samples = iter(())
+            time.sleep(delta_t)
+            return None
+
+        if self.first is None:
+            self.first = t
+            self.base = time.time()
+        self.t = t
+        if self.speed > 0:
+            wait = self.base + (t - self.first) / self.speed - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        return data
+
+def sourceParser(prog='8SpaceDataProcessor'):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('--port', action='append', metavar='[NAME=]PORT',
+                        help='serial port to open instead of looking for the Arduino; repeat for more devices')
+    parser.add_argument('--replay', metavar='PATH', help='play back a .db session or a capture file')
+    parser.add_argument('--session', type=int, help='session id to replay, the last one by default')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 0 for as fast as possible')
+    parser.add_argument('--journal', metavar='DIR', default=journal_dir, help='directory for the raw line journal')
+    parser.add_argument('--no-journal', dest='journal', action='store_const', const=None, help='do not keep a raw journal')
+    parser.add_argument('--p0', type=float, default=p0, help='reference pressure for the altitude, Pa')
+    parser.add_argument('--metrics', type=int, metavar='PORT', help='serve metrics on http://127.0.0.1:PORT/metrics')
+    return parser
+
+def openSources(options):
+    # The first source is the primary one, shown by the GUI. The altitude
+    # reference and the estimate's inputs are set here too, before any
+    # derived channel is computed.
+    setP0(options.p0)
+    setEstimate()
+    if options.replay:
+        return [Replay(options.replay, options.session, options.speed)]
+    ports = options.port
+    if not ports:
+        found = findPorts()
+        ports = ['COM' + np for np in found] if len(found) > 1 else [None]
+
+    sources = []
+    for entry in ports:
+        name = None
+        if entry is not None and '=' in entry:
+            name, entry = entry.split('=', 1)
+        sources.append(Arduino(entry, name))
+    if options.journal:
+        for source in sources:
+            # Several devices journal into a directory each
+            directory = options.journal
+            if len(sources) > 1:
+                directory = os.path.join(directory, source.id)
+            source.journal = Journal(directory)
+    return sources
+
+# ----------------------------------------------------------------------
+# Acquisition
+# ----------------------------------------------------------------------
+
+class SampleReader(threading.Thread):
+    def __init__(self, source, queues):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.source = source
+        self.queues = queues
+        self.running = False
+
+    def run(self):
+        self.running = True
+        read = metrics.histogram('read_seconds', source=self.source.id)
+        samples = metrics.counter('samples_total', source=self.source.id)
+        while self.running:
+            start = time.time()
+            data = self.source.getData()
+            read.observe(time.time() - start)
+            if data is not None:
+                samples.inc()
+                sample = (self.source.now(), data, self.source.id)
+                for queue in self.queues:
+                    queue.put(sample)
+        if self.source.journal is not None:
+            self.source.journal.close()
+
+    def stop(self):
+        self.running = False
+
+class SampleStream():
+    # Samples are (receive time, data, source id). Every source has its
+    # own reader thread, so a slow port only delays its own samples.
+    # Derived channels are computed once, in drain(), and subscribers get
+    # those same frames.
+    def __init__(self, sources, capacity=chunk_size):
+        if not isinstance(sources, (list, tuple)):
+            sources = [sources]
+        self.queue = Queue.Queue()
+        self.queues = [self.queue]
+        self.subscribers = []
+        self.readers = [SampleReader(source, self.queues) for source in sources]
+        self.primary = sources[0].id
+        self.batch = []
+        self.t0 = time.time()
+
+        # Every drained sample with its derived channels, one frame store per
+        # source in the Arduino's units; self.frames is the primary source's
+        self.sourceFrames = {}
+        self.pipelines = {}
+        for source in sources:
+            spill = spillPath('frames' if source.id == self.primary else 'frames-' + source.id)
+            self.sourceFrames[source.id] = FrameStore(capacity, channelNames(), spill)
+            self.pipelines[source.id] = DerivedPipeline()
+        self.frames = self.sourceFrames[self.primary]
+        self.latest = {}
+        self.fresh = 0
+
+    def subscribe(self):
+        # Extra consumers (e.g. the database) get every drained batch on
+        # their own queue as (t, frames, source id), one per source, so
+        # they only see samples once drain() has run
+        queue = Queue.Queue()
+        self.subscribers.append(queue)
+        return queue
+
+    def start(self):
+        for reader in self.readers:
+            if not reader.is_alive():
+                reader.start()
+
+    def stop(self):
+        for reader in self.readers:
+            reader.stop()
+        for reader in self.readers:
+            if reader.is_alive():
+                reader.join(1.0)
+
+    def drain(self):
+        # Everything received since the last frame, shared by all consumers,
+        # in receive order across sources
+        start = time.time()
+        batch = []
+        try:
+            while True:
+                batch.append(self.queue.get_nowait())
+        except Queue.Empty:
+            pass
+        if len(self.readers) > 1:
+            batch.sort(key=lambda sample: sample[0])
+        self.batch = batch
+
+        bySource = {}
+        for sample in batch:
+            bySource.setdefault(sample[2], []).append(sample)
+        for sid, samples in bySource.items():
+            t = np.array([s[0] for s in samples])
+            frames = self.pipelines[sid].compute(t, [s[1] for s in samples])
+            self.sourceFrames[sid].extend(t, frames)
+            self.latest[sid] = frames[-1].tolist()
+            for queue in self.subscribers:
+                queue.put((t, frames, sid))
+        # Frames the primary source gained in this drain
+        self.fresh = len(bySource.get(self.primary, ()))
+        metrics.gauge('stream_batch').set(len(batch))
+        metrics.histogram('drain_seconds').observe(time.time() - start)
+        return batch
+
+# ----------------------------------------------------------------------
+# Alarms
+# ----------------------------------------------------------------------
+
+class AlarmEvent():
+    def __init__(self, rule, source, t, raised, value):
+        self.rule = rule
+        self.source = source
+        self.t = t
+        self.raised = raised
+        self.value = value
+
+    def __str__(self):
+        return '01A-Alarm %s %s on %s (%.3f)' %(self.rule, 'raised' if self.raised else 'cleared', self.source, self.value)
+
+class Rule():
+    # Alarm on one channel, in the Arduino's units. The watched quantity
+    # is the value, or with rate=True its change per second over `window`
+    # seconds. It trips above `above` or below `below`, holds until it is
+    # back by `hysteresis`, and raises only after `sustain` seconds.
+    # Everything is evaluated per batch with a few values carried over,
+    # so the cost doesn't depend on the history kept.
+    def __init__(self, name, channel, above=None, below=None, rate=False, window=1.0,
+                 hysteresis=0.0, sustain=0.0, source=None):
+        self.name = name
+        self.channel = channel
+        self.above = above
+        self.below = below
+        self.rate = rate
+        self.window = window
+        self.hysteresis = hysteresis
+        self.sustain = sustain
+        self.source = source
+        self.reset()
+
+    def reset(self):
+        self.state = False
+        self.since = None
+        self.active = False
+        self.value = None
+        # Samples inside the rate window, for the next batch
+        self.tail = None
+
+    def quantity(self, t, v):
+        if not self.rate:
+            return v
+        rate, self.tail = slope(self.tail, t, v, self.window)
+        return rate
+
+    def evaluate(self, t, v):
+        # Returns (index, raised, quantity) for every transition in this batch
+        # Missing values neither trip nor clear the rule
+        x = self.quantity(t, v)
+        seen = np.isfinite(x)
+        known = np.where(seen, x, 0.0)
+        trip = np.zeros(len(x), bool)
+        back = seen.copy()
+        if self.above is not None:
+            trip |= known > self.above
+            back &= known <= self.above - self.hysteresis
+        if self.below is not None:
+            trip |= known < self.below
+            back &= known >= self.below + self.hysteresis
+        trip &= seen
+
+        # Hysteresis: the state is whatever the last trip or back set it to
+        index = np.arange(len(x))
+        last = np.maximum.accumulate(np.where(trip | back, index, -1))
+        state = np.where(last >= 0, trip[np.maximum(last, 0)], self.state)
+
+        # Sustain: when did the current run of `state` begin
+        begins = state & ~np.concatenate(([self.state], state[:-1]))
+        start = np.maximum.accumulate(np.where(begins, index, -1))
+        runStart = np.where(start >= 0, t[np.maximum(start, 0)], self.since if self.since is not None else 0.0)
+        active = state & (t - runStart >= self.sustain)
+
+        changes = np.flatnonzero(active != np.concatenate(([self.active], active[:-1])))
+        self.state = bool(state[-1])
+        self.since = float(runStart[-1]) if self.state else None
+        self.active = bool(active[-1])
+        if seen.any():
+            self.value = float(x[seen][-1])
+        return [(i, bool(active[i]), float(x[i])) for i in changes]
+
+class AlarmEngine():
+    # Feeds each rule the frames its source gained since the last update
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self.seen = {}
+
+    def update(self, stream):
+        events = []
+        fresh = {}
+        for sid, store in stream.sourceFrames.items():
+            new = min(store.total - self.seen.get(sid, 0), len(store))
+            self.seen[sid] = store.total
+            fresh[sid] = (store, new)
+        for rule in self.rules:
+            sid = rule.source or stream.primary
+            store, new = fresh.get(sid, (None, 0))
+            if new <= 0:
+                continue
+            t = store.recent('t', new)
+            for i, raised, value in rule.evaluate(t, store.recent(rule.channel, new)):
+                events.append(AlarmEvent(rule.name, sid, float(t[i]), raised, value))
+        events.sort(key=lambda event: event.t)
+        for event in events:
+            log.message(str(event))
+            metrics.counter('alarm_events_total', rule=event.rule).inc()
+        return events
+
+    def active(self):
+        return [rule.name for rule in self.rules if rule.active]
+
+# Limits in the Arduino's units: C, hPa (per second for rates), pcs/L
+alarm_rules = [
+    Rule('temp-range', 'temp', above=60.0, below=-40.0, hysteresis=1.0, sustain=2.0),
+    Rule('press-drop', 'press', below=-5.0, rate=True, window=1.0, hysteresis=1.0, sustain=1.0),
+    Rule('dust-spike', 'poll', above=10000.0, hysteresis=1000.0)
+]
+
+# ----------------------------------------------------------------------
+# Data recording
+# ----------------------------------------------------------------------
+
+def createSchema(c):
+    # Timestamps are integer microseconds since the epoch, strictly
+    # increasing inside a session so (session, t) is a unique key
+    c.execute('CREATE TABLE IF NOT EXISTS sessions(id INTEGER PRIMARY KEY, started INTEGER, version TEXT, source TEXT)')
+    if 'source' not in [row[1] for row in c.execute('PRAGMA table_info(sessions)').fetchall()]:
+        c.execute('ALTER TABLE sessions ADD COLUMN source TEXT')
+    c.execute('CREATE TABLE IF NOT EXISTS channels(name TEXT PRIMARY KEY, um TEXT)')
+    c.execute('CREATE TABLE IF NOT EXISTS samples(session INTEGER, t INTEGER, %s, '
+              'PRIMARY KEY (session, t)) WITHOUT ROWID' %(', '.join(['%s REAL' %(name) for name in channelNames()])))
+    # Channels registered since the database was made get a column each
+    columns = set([row[1] for row in c.execute('PRAGMA table_info(samples)').fetchall()])
+    for name in channelNames():
+        if name not in columns:
+            c.execute('ALTER TABLE samples ADD COLUMN %s REAL' %(name))
+    c.executemany('INSERT OR IGNORE INTO channels VALUES (?, ?)', [(ch.name, ch.stored) for ch in registry])
+    c.execute('CREATE TABLE IF NOT EXISTS alarms(session INTEGER, t INTEGER, rule TEXT, raised INTEGER, value REAL)')
+
+def insertSamples():
+    # Rows are (session, t) followed by every registered channel
+    names = channelNames()
+    return 'INSERT INTO samples (session, t, %s) VALUES (?, ?, %s)' %(', '.join(names), ', '.join(['?'] * len(names)))
+
+def migrateRecords(conn):
+    # Moves the old temp/press/poll tables (one row each per record, text
+    # dates) into samples, starting a new session at every long gap
+    c = conn.cursor()
+    tables = set([row[0] for row in c.execute("SELECT name FROM sqlite_master WHERE type='table'")])
+    if not set(('temp', 'press', 'poll')) <= tables:
+        return
+
+    log.message('00C-Migrating old records')
+    rows = conn.execute('SELECT temp.date, temp.value, press.value, poll.value FROM temp '
+                        'JOIN press ON press.rowid = temp.rowid '
+                        'JOIN poll ON poll.rowid = temp.rowid ORDER BY temp.rowid')
+    legacy = 'INSERT INTO samples (session, t, temp, press, poll) VALUES (?, ?, ?, ?, ?)'
+    session = None
+    last = None
+    samples = []
+    for date, temp, press, poll in rows.fetchall():
+        t = int(time.mktime(time.strptime(date, '%Y-%m-%d %H:%M:%S'))) * 1000000
+        if last is None or t - last > db_session_gap * 1000000:
+            c.execute('INSERT INTO sessions(started, version) VALUES (?, ?)', (t, 'legacy'))
+            session = c.lastrowid
+        elif t <= last:
+            t = last + 1
+        last = t
+        samples.append((session, t, temp, press, poll))
+        if len(samples) >= 10000:
+            c.executemany(legacy, samples)
+            samples = []
+    c.executemany(legacy, samples)
+
+    for table in ('temp', 'press', 'poll'):
+        c.execute('ALTER TABLE %s RENAME TO %s_v1' %(table, table))
+    conn.commit()
+
+class SQLite(threading.Thread):
+    def __init__(self, queue, batchSize=db_batch_size, interval=db_commit_interval, path=db_path):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.queue = queue
+        self.batchSize = batchSize
+        self.interval = interval
+        self.rows = []
+        self.alarms = []
+        # Each source records into its own session: {source id: [session, last t]}
+        self.sessions = {}
+        self.convert = [channel.storing() for channel in registry]
+        self.insert = insertSamples()
+
+    def open(self):
+        # sqlite3 connections may only be used by the thread that made them
+        self.conn = sqlite3.connect(self.path)
+        self.c = self.conn.cursor()
+        self.c.execute('PRAGMA journal_mode=WAL')
+        self.c.execute('PRAGMA synchronous=NORMAL')
+
+        createSchema(self.c)
+        migrateRecords(self.conn)
+        self.conn.commit()
+
+    def session(self, source):
+        if source not in self.sessions:
+            self.c.execute('INSERT INTO sessions(started, version, source) VALUES (?, ?, ?)',
+                           (int(time.time() * 1000000), VERSION, source))
+            self.sessions[source] = [self.c.lastrowid, 0]
+        return self.sessions[source]
+
+    def run(self):
+        self.open()
+        last = time.time()
+        while True:
+            try:
+                sample = self.queue.get(timeout=self.interval)
+            except Queue.Empty:
+                sample = ()
+            if sample is None:
+                break
+
+            if isinstance(sample, AlarmEvent):
+                self.queueAlarm(sample)
+            elif sample:
+                self.queueRecords(*sample)
+            if len(self.rows) >= self.batchSize or time.time() - last >= self.interval:
+                self.addRecords()
+                last = time.time()
+        self.close()
+
+    def queueRecords(self, t, frames, source):
+        # One drained batch of a source's frames, derived channels included
+        session = self.session(source)
+        # Microseconds, strictly increasing inside the session: with
+        # w = t - i, each t[i] >= t[i - 1] + 1 is w[i] >= w[i - 1]
+        k = np.arange(len(t))
+        w = (np.asarray(t) * 1000000).astype(np.int64) - k
+        w[0] = max(w[0], session[1] + 1)
+        t = (np.maximum.accumulate(w) + k).tolist()
+        session[1] = t[-1]
+        columns = [f(column).tolist() for f, column in zip(self.convert, frames.T)]
+        self.rows.extend(zip([session[0]] * len(t), t, *columns))
+
+    def queueAlarm(self, event):
+        session = self.session(event.source)
+        self.alarms.append((session[0], int(event.t * 1000000), event.rule, int(event.raised), event.value))
+
+    def alarm(self, event):
+        # Alarm events share the sample queue so they land in order
+        self.queue.put(event)
+
+    def addRecords(self):
+        metrics.gauge('db_queue_depth').set(self.queue.qsize())
+        if not self.rows and not self.alarms:
+            return
+        start = time.time()
+        self.c.executemany(self.insert, self.rows)
+        self.c.executemany('INSERT INTO alarms VALUES (?, ?, ?, ?, ?)', self.alarms)
+        self.conn.commit()
+        metrics.histogram('db_commit_seconds').observe(time.time() - start)
+        metrics.counter('db_rows_total').inc(len(self.rows))
+        self.rows = []
+        self.alarms = []
+
+    def stop(self):
+        # Samples already queued are written before the thread exits
+        self.queue.put(None)
+        if self.is_alive():
+            self.join(5.0)
+
+    def close(self):
+        self.addRecords()
+        self.conn.close()
+
+class Records():
+    # Read side of the database for post-flight analysis. Times are in
+    # seconds since the epoch on input and integer microseconds on output.
+    aggregates = ('avg', 'min', 'max', 'sum', 'count')
+
+    def __init__(self, path=db_path, writable=False):
+        # Read-only unless asked for: schema changes and moving old tables
+        # over are left to the recorder and recover.py
+        if not os.path.exists(path):
+            raise ValueError('No database at %s' %(path))
+        self.conn = sqlite3.connect(path)
+        if not writable:
+            self.conn.execute('PRAGMA query_only = ON')
+        self.tables = set([row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type='table'")])
+        if 'samples' not in self.tables:
+            raise ValueError('%s has no samples yet; record into it or run recover.py first' %(path))
+
+    def sessions(self):
+        # Databases from before multi-device recording have no source
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(sessions)').fetchall()]
+        source = 'source' if 'source' in columns else 'NULL'
+        return self.conn.execute('SELECT id, started, version, %s FROM sessions ORDER BY id' %(source)).fetchall()
+
+    def lastSession(self):
+        return self.conn.execute('SELECT MAX(session) FROM samples').fetchone()[0]
+
+    def units(self):
+        return dict(self.conn.execute('SELECT name, um FROM channels').fetchall())
+
+    def alarms(self, session):
+        if 'alarms' not in self.tables:
+            return []
+        return self.conn.execute('SELECT t, rule, raised, value FROM alarms WHERE session = ? ORDER BY t',
+                                 (session,)).fetchall()
+
+    def query(self, session, start=None, end=None, channels=None, bucket=None, agg='avg', after=None, limit=None):
+        units = self.units()
+        if channels is None:
+            channels = [name for name in channelNames() if name in units]
+        for name in channels:
+            if name not in units:
+                raise ValueError('Unknown channel %s' %(name))
+        if agg not in self.aggregates:
+            raise ValueError('Unknown aggregate %s' %(agg))
+
+        where = 'session = ?'
+        params = [session]
+        if start is not None:
+            where += ' AND t >= ?'
+            params.append(int(start * 1000000))
+        if end is not None:
+            where += ' AND t < ?'
+            params.append(int(end * 1000000))
+        if after is not None:
+            where += ' AND t > ?'
+            params.append(int(after))
+
+        if bucket is None:
+            sql = 'SELECT t, %s FROM samples WHERE %s ORDER BY t' %(', '.join(channels), where)
+        else:
+            width = max(int(bucket * 1000000), 1)
+            columns = ', '.join(['%s(%s)' %(agg, name) for name in channels])
+            sql = 'SELECT (t / %d) * %d AS b, %s FROM samples WHERE %s GROUP BY b ORDER BY b' \
+                %(width, width, columns, where)
+        if limit is not None:
+            sql += ' LIMIT %d' %(limit)
+
+        rows = self.conn.execute(sql, params).fetchall()
+        t = np.fromiter((row[0] for row in rows), np.int64, len(rows))
+        values = np.array([row[1:] for row in rows], dtype=float).reshape(len(rows), len(channels))
+        return t, values
+
+    def count(self, session, start=None, end=None, bucket=None):
+        # Number of rows query() would return
+        where = 'session = ?'
+        params = [session]
+        if start is not None:
+            where += ' AND t >= ?'
+            params.append(int(start * 1000000))
+        if end is not None:
+            where += ' AND t < ?'
+            params.append(int(end * 1000000))
+        if bucket is None:
+            what = 'COUNT(*)'
+        else:
+            what = 'COUNT(DISTINCT t / %d)' %(max(int(bucket * 1000000), 1))
+        return self.conn.execute('SELECT %s FROM samples WHERE %s' %(what, where), params).fetchone()[0]
+
+    def sensorChunks(self, session, size=10000):
+        # The session's sensor columns as (t, (n, sensors) data) chunks in
+        # the channels' base units, the way a source hands them out.
+        # Sensors the database has no column for are missing.
+        stored = self.units()
+        names = [name for name in sensorNames() if name in stored]
+        convert = [conversion(name, stored[name], channelIndex[name].base) for name in names]
+        columns = [sensorNames().index(name) for name in names]
+        for t, values in self.chunks(session, channels=names, size=size):
+            data = np.empty((len(t), len(sensors)))
+            data.fill(missing_value)
+            for i, (column, f) in enumerate(zip(columns, convert)):
+                data[:, column] = f(values[:, i])
+            yield t, data
+
+    def chunks(self, session, start=None, end=None, channels=None, size=10000, bucket=None, agg='avg'):
+        # Keyset pagination over (session, t), so memory stays bounded
+        after = None
+        while True:
+            t, values = self.query(session, start, end, channels, bucket, agg, after=after, limit=size)
+            if not len(t):
+                break
+            yield t, values
+            after = t[-1]
+            if bucket is not None:
+                # t is the start of the last bucket; skip the rest of it
+                after += max(int(bucket * 1000000), 1) - 1
+
+    def close(self):
+        self.conn.close()
+
+# ----------------------------------------------------------------------
+# Export
+# ----------------------------------------------------------------------
+
+# Exports hold one int64 column 't' (µs since the epoch) and one float64
+# column per channel, each with its unit from the channels table
+export_formats = {'.npz' : 'npz', '.parquet' : 'parquet', '.h5' : 'hdf5', '.hdf5' : 'hdf5'}
+
+class NpzExport():
+    # Columns are filled through .npy memmaps, then stored in the archive
+    def __init__(self, path, channels, units, rows, meta):
+        self.path = path
+        self.channels = channels
+        self.units = units
+        self.meta = meta
+        self.scratch = tempfile.mkdtemp(prefix='8space-export-', dir=os.path.dirname(os.path.abspath(path)))
+        self.columns = [np.lib.format.open_memmap(os.path.join(self.scratch, 't.npy'), 'w+', np.int64, (rows,))]
+        for name in channels:
+            self.columns.append(np.lib.format.open_memmap(os.path.join(self.scratch, name + '.npy'), 'w+', np.float64, (rows,)))
+        self.pos = 0
+
+    def write(self, t, values):
+        n = len(t)
+        self.columns[0][self.pos:self.pos + n] = t
+        for i in xrange(len(self.channels)):
+            self.columns[i + 1][self.pos:self.pos + n] = values[:, i]
+        self.pos += n
+
+    def close(self):
+        for column in self.columns:
+            column.flush()
+        self.columns = None
+        extra = {
+            'channels' : np.array(self.channels),
+            'units' : np.array([self.units[name] for name in self.channels])
+        }
+        for key, value in self.meta.items():
+            extra[key] = np.array(value)
+        try:
+            with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+                for name in ['t'] + list(self.channels):
+                    archive.write(os.path.join(self.scratch, name + '.npy'), name + '.npy')
+                for name, value in extra.items():
+                    data = io.BytesIO()
+                    np.save(data, value)
+                    archive.writestr(name + '.npy', data.getvalue())
+        finally:
+            shutil.rmtree(self.scratch, True)
+
+class ParquetExport():
+    def __init__(self, path, channels, units, rows, meta):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Parquet export needs pyarrow')
+        self.pa = pyarrow
+        self.channels = channels
+        fields = [pyarrow.field('t', pyarrow.int64(), metadata={'unit' : 'us'})]
+        for name in channels:
+            fields.append(pyarrow.field(name, pyarrow.float64(), metadata={'unit' : units[name]}))
+        self.schema = pyarrow.schema(fields, metadata=dict([(k, str(v)) for k, v in meta.items()]))
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, t, values):
+        arrays = [self.pa.array(t)] + [self.pa.array(values[:, i]) for i in xrange(len(self.channels))]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+class HDF5Export():
+    def __init__(self, path, channels, units, rows, meta):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError('HDF5 export needs h5py')
+        self.file = h5py.File(path, 'w')
+        for key, value in meta.items():
+            self.file.attrs[key] = value
+        self.columns = [self.file.create_dataset('t', (rows,), 'i8')]
+        self.columns[0].attrs['unit'] = 'us'
+        for name in channels:
+            column = self.file.create_dataset(name, (rows,), 'f8')
+            column.attrs['unit'] = units[name]
+            self.columns.append(column)
+        self.pos = 0
+
+    def write(self, t, values):
+        n = len(t)
+        self.columns[0][self.pos:self.pos + n] = t
+        for i in xrange(len(self.columns) - 1):
+            self.columns[i + 1][self.pos:self.pos + n] = values[:, i]
+        self.pos += n
+
+    def close(self):
+        self.file.close()
+
+exporters = {'npz' : NpzExport, 'parquet' : ParquetExport, 'hdf5' : HDF5Export}
+
+def exportSession(records, path, session=None, start=None, end=None, channels=None,
+                  bucket=None, agg='avg', step=1, size=10000):
+    # Streams one session into path, its format picked by the extension.
+    # bucket aggregates over that many seconds, step keeps every step-th
+    # row. Returns the number of rows written.
+    fmt = export_formats.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError('Unknown export format %s' %(path))
+    if session is None:
+        session = records.lastSession()
+    if channels is None:
+        channels = channelNames()
+
+    # Rows recorded while exporting are left out
+    rows = records.count(session, start, end, bucket)
+    rows = (rows + step - 1) // step
+    meta = {'session' : session, 'version' : VERSION, 'agg' : agg if bucket else 'none',
+            'bucket' : bucket or 0, 'step' : step}
+    writer = exporters[fmt](path, channels, records.units(), rows, meta)
+    written = 0
+    skip = 0
+    try:
+        for t, values in records.chunks(session, start, end, channels, size, bucket, agg):
+            t = t[skip::step]
+            values = values[skip::step]
+            skip = (skip - size) % step
+            t = t[:rows - written]
+            values = values[:rows - written]
+            writer.write(t, values)
+            written += len(t)
+            if written >= rows:
+                break
+    finally:
+        writer.close()
+    return written
+
+# ----------------------------------------------------------------------
+# Journal
+# ----------------------------------------------------------------------
+
+# Segments are preallocated and memory-mapped. Each one starts with a
+# header (magic, run start in µs, segment index) followed by records of
+# (payload length, crc32, receive time) and the raw line. The first
+# all-zero record header or bad checksum marks where the writer stopped;
+# blank lines are kept as empty records, whose checksum is never zero.
+journal_magic = 'CSJ1'
+journal_header = struct.Struct('<4sqI')
+journal_record = struct.Struct('<IId')
+
+def journalName(directory, run, index):
+    return os.path.join(directory, '%d-%04d.journal' %(run, index))
+
+def journalRun(path):
+    # The run a segment belongs to, or None if it isn't named like one
+    try:
+        return int(os.path.basename(path).split('-')[0])
+    except ValueError:
+        return None
+
+def journalRuns(directory):
+    # {run: [segment paths in order]}
+    runs = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*-*.journal'))):
+        run = journalRun(path)
+        if run is not None:
+            runs.setdefault(run, []).append(path)
+    return runs
+
+class Journal():
+    # Append-only log of every raw line read from the source, written by
+    # the reader thread only
+    def __init__(self, directory=journal_dir, segmentSize=journal_segment_size, syncInterval=journal_sync_interval):
+        self.directory = directory
+        self.segmentSize = segmentSize
+        self.syncInterval = syncInterval
+        self.run = int(time.time() * 1000000)
+        self.index = -1
+        self.file = None
+        self.mm = None
+
+    def open(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.index += 1
+        self.file = open(journalName(self.directory, self.run, self.index), 'w+b')
+        self.file.truncate(self.segmentSize)
+        self.mm = mmap.mmap(self.file.fileno(), self.segmentSize)
+        self.mm[0:journal_header.size] = journal_header.pack(journal_magic, self.run, self.index)
+        self.pos = journal_header.size
+        self.synced = time.time()
+
+    def append(self, t, line):
+        payload = line.encode('utf-8') if isinstance(line, unicode) else line
+        size = journal_record.size + len(payload)
+        if self.mm is None:
+            self.open()
+        elif self.pos + size > self.segmentSize:
+            self.rotate()
+        head = struct.pack('<d', t)
+        record = journal_record.pack(len(payload), zlib.crc32(head + payload) & 0xffffffff, t) + payload
+        self.mm[self.pos:self.pos + size] = record
+        self.pos += size
+
+        if t - self.synced >= self.syncInterval:
+            self.sync()
+
+    def sync(self):
+        # The page cache already survives a crash of this process; the
+        # flush bounds what an OS crash or power cut can take
+        self.mm.flush()
+        self.synced = time.time()
+
+    def rotate(self):
+        self.close()
+        self.open()
+
+    def close(self):
+        if self.mm is None:
+            return
+        self.mm.flush()
+        self.mm.close()
+        self.file.truncate(self.pos)
+        self.file.close()
+        self.mm = None
+
+def readJournal(paths):
+    # Yields (receive time, raw line) from the given segments of one run
+    for path in paths:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < journal_header.size:
+                continue
+            mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                if journal_header.unpack_from(mm, 0)[0] != journal_magic:
+                    log.message('00E-Not a journal: %s' %(path))
+                    continue
+                pos = journal_header.size
+                while pos + journal_record.size <= size:
+                    length, crc, t = journal_record.unpack_from(mm, pos)
+                    end = pos + journal_record.size + length
+                    if (length == 0 and crc == 0 and t == 0) or end > size:
+                        break
+                    payload = mm[pos + journal_record.size:end]
+                    if zlib.crc32(mm[pos + 8:pos + 16] + payload) & 0xffffffff != crc:
+                        log.message('00E-Journal damaged at %s:%d' %(path, pos))
+                        break
+                    yield t, payload
+                    pos = end
+            finally:
+                mm.close()
+
+# ----------------------------------------------------------------------
+# Statistics
+# ----------------------------------------------------------------------
+
+class RunningStats():
+    # Welford's online mean and variance
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def push(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def extend(self, values):
+        # Chan et al.'s merge of the batch's own mean and M2
+        values = np.asarray(values, dtype=float)
+        n = len(values)
+        if not n:
+            return
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+
+    def variance(self):
+        if self.n < 2:
+            return 0.0
+        return self.m2 / (self.n - 1)
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+class EWMA():
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.value = None
+
+    def push(self, x):
+        if self.value is None:
+            self.value = x
+        else:
+            self.value += self.alpha * (x - self.value)
+
+    def extend(self, values):
+        # Closed form of pushing the values one at a time
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return
+        if self.value is None:
+            self.value = float(values[0])
+            values = values[1:]
+        n = len(values)
+        decay = (1 - self.alpha) ** np.arange(n - 1, -1, -1)
+        self.value = float(self.value * (1 - self.alpha) ** n + self.alpha * np.dot(decay, values))
+
+class SlidingWindow():
+    # Mean, min and max over the last `size` samples. Min and max use
+    # monotonic deques of (index, value), the sum is refreshed once per
+    # window to keep rounding errors from piling up. A batch finds its
+    # own min and max candidates in NumPy, so every sample is appended
+    # and dropped at most once whatever the batch size.
+    def __init__(self, size):
+        self.size = size
+        self.values = collections.deque(maxlen=size)
+        self.total = 0.0
+        self.i = 0
+        self.lo = collections.deque()
+        self.hi = collections.deque()
+
+    def push(self, x):
+        self.extend([x])
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=float)[-self.size:]
+        n = len(values)
+        if not n:
+            return
+        dropped = len(self.values) + n - self.size
+        if dropped > 0:
+            self.total -= math.fsum(itertools.islice(self.values, dropped))
+        self.values.extend(values.tolist())
+        self.total += float(values.sum())
+        if (self.i + n) // self.size != self.i // self.size:
+            self.total = math.fsum(self.values)
+        index = np.arange(self.i + 1, self.i + n + 1)
+        self.i += n
+
+        # A sample stays a candidate only while nothing after it is lower
+        # (higher for the max)
+        later = np.append(np.minimum.accumulate(values[::-1])[::-1][1:], np.inf)
+        keep = values < later
+        while self.lo and self.lo[-1][1] >= values.min():
+            self.lo.pop()
+        self.lo.extend(zip(index[keep].tolist(), values[keep].tolist()))
+        while self.lo[0][0] <= self.i - self.size:
+            self.lo.popleft()
+
+        later = np.append(np.maximum.accumulate(values[::-1])[::-1][1:], -np.inf)
+        keep = values > later
+        while self.hi and self.hi[-1][1] <= values.max():
+            self.hi.pop()
+        self.hi.extend(zip(index[keep].tolist(), values[keep].tolist()))
+        while self.hi[0][0] <= self.i - self.size:
+            self.hi.popleft()
+
+    def mean(self):
+        if not self.values:
+            return 0.0
+        return self.total / len(self.values)
+
+    def min(self):
+        return self.lo[0][1] if self.lo else 0.0
+
+    def max(self):
+        return self.hi[0][1] if self.hi else 0.0
+
+class P2Quantiles():
+    # Jain & Chlamtac P-square estimate of the quantiles `ps`, extended
+    # (Raatikainen) to share one set of 2m + 3 markers: one search and one
+    # pass over the markers per sample, however many quantiles are kept
+    def __init__(self, ps):
+        self.ps = sorted(ps)
+        self.dn = [0.0]
+        for lo, hi in zip([0.0] + self.ps, self.ps + [1.0]):
+            self.dn += [(lo + hi) / 2, hi]
+        self.dn[-1] = 1.0
+        self.index = dict([(p, 2 * i + 2) for i, p in enumerate(self.ps)])
+        self.q = []
+        self.n = None
+        self.count = 0
+
+    def push(self, x):
+        q = self.q
+        self.count += 1
+        if self.n is None:
+            q.append(x)
+            if len(q) == len(self.dn):
+                q.sort()
+                self.n = [float(i) for i in xrange(len(q))]
+            return
+
+        n = self.n
+        top = len(q) - 1
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[top]:
+            q[top] = x
+            k = top - 1
+        else:
+            k = bisect.bisect_right(q, x) - 1
+
+        for i in xrange(k + 1, top + 1):
+            n[i] += 1
+        # Marker i should sit at dn[i] * (count - 1)
+        c = self.count - 1
+        dn = self.dn
+        for i in xrange(1, top):
+            d = dn[i] * c - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self, p):
+        if self.n is None:
+            if not self.q:
+                return 0.0
+            l = sorted(self.q)
+            return l[int(round(p * (len(l) - 1)))]
+        return self.q[self.index[p]]
+
+class P2Quantile(P2Quantiles):
+    def __init__(self, p):
+        P2Quantiles.__init__(self, [p])
+        self.p = p
+
+    def value(self):
+        return P2Quantiles.value(self, self.p)
+
+class InterquartileMean():
+    # 2 * integral of the quantile function over [0.25, 0.75], estimated
+    # from evenly spaced P-square quantiles with the trapezoid rule
+    def __init__(self, steps=8):
+        self.steps = steps
+        self.ps = [0.25 + 0.5 * j / steps for j in xrange(steps + 1)]
+        self.quantiles = P2Quantiles(self.ps)
+
+    def push(self, x):
+        self.quantiles.push(x)
+
+    def value(self):
+        q = [self.quantiles.value(p) for p in self.ps]
+        return (sum(q[1:-1]) + (q[0] + q[-1]) / 2.0) / self.steps
+
+class ChannelStats():
+    # Mean, variance, EWMA and window stats take a whole batch in NumPy.
+    # The P-square markers can only go a sample at a time, so they are
+    # kept only when `quantiles` asks for median and iqm; the median is
+    # one of the iqm's markers.
+    def __init__(self, window=stats_window, alpha=ewma_alpha, quantiles=False):
+        self.running = RunningStats()
+        self.ewma = EWMA(alpha)
+        self.window = SlidingWindow(window)
+        self.iqm = InterquartileMean() if quantiles else None
+
+    def push(self, x):
+        self.extend([x])
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        self.running.extend(values)
+        self.ewma.extend(values)
+        self.window.extend(values)
+        if self.iqm is not None:
+            push = self.iqm.push
+            for value in values.tolist():
+                push(value)
+
+    def value(self, name):
+        values = {
+            'mean' : lambda: self.running.mean,
+            'std' : self.running.std,
+            'ewma' : lambda: self.ewma.value or 0.0,
+            'wmean' : self.window.mean,
+            'wmin' : self.window.min,
+            'wmax' : self.window.max
+        }
+        if self.iqm is not None:
+            values['median'] = lambda: self.iqm.quantiles.value(0.5)
+            values['iqm'] = self.iqm.value
+        return values[name]()
+
+# ----------------------------------------------------------------------
+# Buffers
+# ----------------------------------------------------------------------
+
+def spillPath(name):
+    if spill_evicted:
+        return 'cansat-%s-strv%s.bin' %(name, VERSION)
+    return None
+
+class RingBuffer():
+    # Every row is written twice, at i and i + capacity, so that the
+    # live window is always one contiguous slice of self.buffer.
+    def __init__(self, capacity, columns=2, spill=None):
+        self.capacity = capacity
+        self.columns = columns
+        self.buffer = np.empty((2 * capacity, columns))
+        self.start = 0
+        self.size = 0
+
+        # Evicted rows are appended to the spill file as raw float64
+        self.spill = None
+        if spill is not None:
+            self.spill = open(spill, 'ab')
+
+    def __len__(self):
+        return self.size
+
+    def append(self, row):
+        cap = self.capacity
+        end = (self.start + self.size) % cap
+        if self.size == cap:
+            if self.spill is not None:
+                self.buffer[self.start].tofile(self.spill)
+            self.start = (self.start + 1) % cap
+        else:
+            self.size += 1
+        self.buffer[end] = row
+        self.buffer[end + cap] = row
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=self.buffer.dtype).reshape(-1, self.columns)
+        for i in xrange(0, len(rows), self.capacity):
+            self._extend(rows[i:i + self.capacity])
+
+    def _extend(self, rows):
+        cap = self.capacity
+        n = len(rows)
+        evict = max(0, self.size + n - cap)
+        if evict and self.spill is not None:
+            self.view()[:evict].tofile(self.spill)
+
+        end = (self.start + self.size) % cap
+        first = min(n, cap - end)
+        self.buffer[end:end + first] = rows[:first]
+        self.buffer[end + cap:end + cap + first] = rows[:first]
+        rest = n - first
+        if rest:
+            self.buffer[:rest] = rows[first:]
+            self.buffer[cap:cap + rest] = rows[first:]
+
+        self.start = (self.start + evict) % cap
+        self.size = min(cap, self.size + n)
+
+    def view(self):
+        return self.buffer[self.start:self.start + self.size]
+
+    def last(self):
+        return self.buffer[self.start + self.size - 1]
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+class FrameStore():
+    # Struct of arrays: row 0 of self.buffer is the receive time, row i + 1
+    # channel i. Columns are mirrored like RingBuffer rows, so the live
+    # window of any channel is one contiguous slice.
+    def __init__(self, capacity, names, spill=None):
+        self.capacity = capacity
+        self.names = ['t'] + list(names)
+        self.index = dict([(name, i) for i, name in enumerate(self.names)])
+        self.buffer = np.empty((len(self.names), 2 * capacity))
+        self.start = 0
+        self.size = 0
+        # Frames ever appended, so readers can tell what is new to them
+        self.total = 0
+
+        # Evicted frames are appended to the spill file as raw float64 rows
+        self.spill = None
+        if spill is not None:
+            self.spill = open(spill, 'ab')
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, t, values):
+        t = np.asarray(t, dtype=float)
+        values = np.asarray(values, dtype=float).reshape(len(t), len(self.names) - 1)
+        if not len(t):
+            return
+        # Receive times never go backwards, whatever the wall clock does
+        if self.size:
+            t = np.maximum(t, self.last('t'))
+        t = np.maximum.accumulate(t)
+        frames = np.vstack((t, values.T))
+        for i in xrange(0, len(t), self.capacity):
+            self._extend(frames[:, i:i + self.capacity])
+        self.total += len(t)
+
+    def _extend(self, frames):
+        cap = self.capacity
+        n = frames.shape[1]
+        evict = max(0, self.size + n - cap)
+        if evict and self.spill is not None:
+            self.view()[:, :evict].T.tofile(self.spill)
+
+        end = (self.start + self.size) % cap
+        first = min(n, cap - end)
+        self.buffer[:, end:end + first] = frames[:, :first]
+        self.buffer[:, end + cap:end + cap + first] = frames[:, :first]
+        rest = n - first
+        if rest:
+            self.buffer[:, :rest] = frames[:, first:]
+            self.buffer[:, cap:cap + rest] = frames[:, first:]
+
+        self.start = (self.start + evict) % cap
+        self.size = min(cap, self.size + n)
+
+    def view(self, name=None):
+        if name is None:
+            return self.buffer[:, self.start:self.start + self.size]
+        return self.buffer[self.index[name], self.start:self.start + self.size]
+
+    def recent(self, name, count):
+        # The last `count` values of a column (fewer if already evicted)
+        return self.view(name)[max(self.size - count, 0):]
+
+    def last(self, name):
+        return self.buffer[self.index[name], self.start + self.size - 1]
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+class MinMaxPyramid():
+    # Level 0 is one channel of a FrameStore against its time column. Each
+    # row of level k > 0 is a bucket (x first, x last, y min, y max) over
+    # `factor` rows of level k - 1.
+    def __init__(self, store, name, factor=lod_factor, minBuckets=64):
+        self.store = store
+        self.name = name
+        self.factor = factor
+        self.levels = [store]
+        capacity = store.capacity // factor
+        while capacity >= minBuckets:
+            self.levels.append(RingBuffer(capacity, 4))
+            capacity //= factor
+        self.seen = store.total
+
+        # Rows of level k - 1 not folded into a bucket of level k yet
+        self.pending = [None] + [np.empty((0, 4)) for level in self.levels[1:]]
+
+    def update(self):
+        # Folds the frames appended to the store since the last call
+        new = min(self.store.total - self.seen, len(self.store))
+        self.seen = self.store.total
+        if new <= 0:
+            return
+        x = self.store.recent('t', new)
+        y = self.store.recent(self.name, new)
+        self.fold(1, np.column_stack((x, x, y, y)))
+
+    def fold(self, k, rows):
+        if k >= len(self.levels):
+            return
+        rows = np.vstack((self.pending[k], rows))
+        n = len(rows) // self.factor * self.factor
+        self.pending[k] = rows[n:].copy()
+        if not n:
+            return
+        groups = rows[:n].reshape(-1, self.factor, 4)
+        # fmin and fmax pass over missing values; an all-missing bucket stays NaN
+        buckets = np.column_stack((groups[:, 0, 0], groups[:, -1, 1],
+                                   np.fmin.reduce(groups[:, :, 2], 1), np.fmax.reduce(groups[:, :, 3], 1)))
+        self.levels[k].extend(buckets)
+        self.fold(k + 1, buckets)
+
+    def tail(self, k):
+        # Samples newer than the last complete bucket of level k
+        parts = [rows for rows in self.pending[1:k + 1] if len(rows)]
+        if not parts:
+            return None
+        return (min([p[0, 0] for p in parts]), max([p[-1, 1] for p in parts]),
+                np.fmin.reduce([np.fmin.reduce(p[:, 2]) for p in parts]),
+                np.fmax.reduce([np.fmax.reduce(p[:, 3]) for p in parts]))
+
+    def bounds(self):
+        x = self.store.view('t')
+        if not len(x):
+            return None
+        return x[0], x[-1]
+
+    def select(self, xMin, xMax, width):
+        # Lowest level that needs at most ~2 points per pixel over the range
+        for k, level in enumerate(self.levels):
+            if k == 0:
+                x = self.store.view('t')
+            else:
+                view = level.view()
+                x = view[:, 0]
+            i0 = max(np.searchsorted(x, xMin, 'left') - 1, 0)
+            i1 = min(np.searchsorted(x, xMax, 'right') + 1, len(x))
+            points = i1 - i0 if k == 0 else 2 * (i1 - i0)
+            if points <= 2 * width or k == len(self.levels) - 1:
+                break
+
+        if k == 0:
+            return x[i0:i1], self.store.view(self.name)[i0:i1]
+
+        view = view[i0:i1]
+        x = view[:, 0:2]
+        y = view[:, 2:4]
+        last = self.tail(k)
+        if last is not None and i1 == len(level):
+            x = np.vstack((x, last[0:2]))
+            y = np.vstack((y, last[2:4]))
+        return x.ravel(), y.ravel()
+
+# ----------------------------------------------------------------------
+# Units
+# ----------------------------------------------------------------------
+
+class Affine():
+    # v * scale + offset, for scalars and NumPy arrays alike
+    def __init__(self, scale=1.0, offset=0.0):
+        self.scale = scale
+        self.offset = offset
+
+    def __call__(self, v):
+        return v * self.scale + self.offset
+
+    def inverse(self):
+        return Affine(1.0 / self.scale, -self.offset / self.scale)
+
+    def then(self, other):
+        if isinstance(other, Affine):
+            return Affine(self.scale * other.scale, self.offset * other.scale + other.offset)
+        return Chain(self, other)
+
+class Barometric():
+    # Standard atmosphere altitude in m from pressure in Pa, or back
+    def __init__(self, P0=p0, inverted=False):
+        self.P0 = P0
+        self.inverted = inverted
+
+    def __call__(self, v):
+        if self.inverted:
+            return self.P0 * (1 - v / 44330.77) ** 5.25588
+        return 44330.77 * (1 - (v / self.P0) ** 0.190263)
+
+    def inverse(self):
+        return Barometric(self.P0, not self.inverted)
+
+    def then(self, other):
+        return Chain(self, other)
+
+class Chain():
+    def __init__(self, *steps):
+        self.steps = steps
+
+    def __call__(self, v):
+        for step in self.steps:
+            v = step(v)
+        return v
+
+    def inverse(self):
+        return Chain(*[step.inverse() for step in reversed(self.steps)])
+
+    def then(self, other):
+        return Chain(*(self.steps + (other,)))
+
+conversions = {}
+
+def conversion(quantity, src, dst):
+    # Affine pairs fold into a single multiply-add, built once per pair
+    key = (quantity, src, dst)
+    if key not in conversions:
+        table = channelIndex[quantity].transforms
+        conversions[key] = table[src].inverse().then(table[dst])
+    return conversions[key]
+
+# ----------------------------------------------------------------------
+# Channels
+# ----------------------------------------------------------------------
+
+class Channel():
+    # One field of the Arduino's CSV line. Parsing, the frame store, the
+    # database columns, the plots and the readout are all built from the
+    # registry. Each of `units` is (unit, name, transform from `base`,
+    # default y range); the first one is displayed by default and
+    # `stored` is the unit the database keeps.
+    def __init__(self, name, label, field, base, stored, units, colour='#ffffff',
+                 sensor=None, axis=None, axes=None, short=None, mean=False):
+        self.name = name
+        self.label = label
+        self.field = field
+        self.base = base
+        self.stored = stored
+        self.units = units
+        self.colour = colour
+        self.sensor = sensor
+        self.axis = axis or label
+        self.axes = axes or {}
+        self.short = short or label
+        self.mean = mean
+        self.transforms = dict([(unit[0], unit[2]) for unit in units])
+        self.ranges = dict([(unit[0], unit[3]) for unit in units])
+
+    def unitNames(self):
+        return [unit[0] for unit in self.units]
+
+    def axisName(self, unit):
+        return self.axes.get(unit, self.axis)
+
+    def storing(self):
+        return conversion(self.name, self.base, self.stored)
+
+class Derived(Channel):
+    # A channel worked out from `inputs` (sensor or derived channel names)
+    # a batch at a time. formula(state, t, *inputs, **params) gets NumPy
+    # arrays in the inputs' base units and returns this channel's values
+    # in `base`; `state` is a dict kept per source between batches, shared
+    # by the channels of one `group`. Inputs are NaN where a field didn't
+    # parse, and formulas give NaN there rather than use it as a reading.
+    def __init__(self, name, label, inputs, formula, base, stored, units, params=None, group=None, **kwargs):
+        Channel.__init__(self, name, label, None, base, stored, units, **kwargs)
+        self.inputs = inputs
+        self.formula = formula
+        self.params = params or {}
+        self.group = group or name
+
+# Sensors come first in registry, so a source's data is a prefix of a frame
+registry = []
+sensors = []
+derived = []
+channelIndex = {}
+
+def register(channel):
+    # Channels must be registered before the source and stream are made.
+    # A derived channel's inputs must already be registered, which keeps
+    # the dependency graph acyclic and `derived` in evaluation order.
+    if channel.name in channelIndex:
+        raise ValueError('channel %s is already registered' %(channel.name))
+    if isinstance(channel, Derived):
+        missing = [name for name in channel.inputs if name not in channelIndex]
+        if missing:
+            raise ValueError('%s needs %s registered first' %(channel.name, ', '.join(missing)))
+        derived.append(channel)
+        registry.append(channel)
+    else:
+        sensors.append(channel)
+        registry.insert(len(sensors) - 1, channel)
+    channelIndex[channel.name] = channel
+
+def channelNames():
+    return [channel.name for channel in registry]
+
+def sensorNames():
+    return [channel.name for channel in sensors]
+
+class DerivedPipeline():
+    # Adds the derived channels to a batch of one source's samples
+    def __init__(self):
+        self.states = dict([(channel.group, {}) for channel in derived])
+
+    def compute(self, t, data):
+        # data is (n, sensors); returns the (n, registry) frames
+        start = time.time()
+        t = np.asarray(t, dtype=float)
+        data = np.asarray(data, dtype=float).reshape(len(t), len(sensors))
+        columns = dict(zip(sensorNames(), data.T))
+        for channel in derived:
+            inputs = [columns[name] for name in channel.inputs]
+            columns[channel.name] = channel.formula(self.states[channel.group], t, *inputs, **channel.params)
+        frames = np.column_stack([columns[name] for name in channelNames()])
+        metrics.histogram('derive_seconds').observe(time.time() - start)
+        return frames
+
+register(Channel('temp', 'Temperature', 0, 'C', 'K', (
+    ('K', 'Kelvin', Affine(1.0, 273.15), (290, 310)),
+    ('C', 'Celsius', Affine(), (17, 37)),
+    ('F', 'Fahrenheit', Affine(1.8, 32.0), (62, 98))),
+    '#ff0000', 'BMP180 - Temp', short='T.', mean=True))
+register(Channel('press', 'Pressure', 1, 'hPa', 'Pa', (
+    ('Pa', 'Pascal', Affine(100.0), (80000, 130000)),
+    ('hPa', 'Hectopascal', Affine(), (800, 1300)),
+    ('kPa', 'Kilopascal', Affine(0.1), (80, 130)),
+    ('m', 'Altitude', Affine(100.0).then(Barometric()), (-500, 2000))),
+    '#00ff00', 'BMP180 - Press', axes={'m' : 'Altitude'}))
+register(Channel('poll', 'Air quality', 2, 'pcs/L', 'pcs/L', (
+    ('pcs/L', 'pcs/L', Affine(), (0, 40000)),
+    ('pcs/cf', 'pcs/cf', Affine(28.3168), (0, 1132672)),
+    ('pcs/m3', 'pcs/m3', Affine(1000.0), (0, 40000000))),
+    '#0000ff', 'PPD42NS - Dust concn', axis='Dust concn'))
+
+# ----------------------------------------------------------------------
+# Obtained
+# ----------------------------------------------------------------------
+
+def hypsometricFormula(P0, P, T):
+    # Altitude in m from pressure P and reference P0 in the same units,
+    # and temperature T in K
+    return ((P0 / P) ** (1 / 5.257) - 1) * T / 0.0065
+
+def slope(tail, t, v, window):
+    # Change of v per second over the last `window` seconds at every
+    # sample, 0 until half a window has been seen so a couple of noisy
+    # samples don't read as a huge rate. tail is the (t, v) still inside
+    # the window after the last batch, or None; the new one is returned
+    # with the rates. Missing values are left out of the window and have
+    # no rate.
+    t = np.asarray(t, dtype=float)
+    v = np.asarray(v, dtype=float)
+    rate = np.empty(len(t))
+    rate.fill(np.nan)
+    seen = np.isfinite(v)
+    n = int(seen.sum())
+    if not n:
+        return rate, tail
+    t, v = t[seen], v[seen]
+    if tail is not None:
+        t = np.concatenate((tail[0], t))
+        v = np.concatenate((tail[1], v))
+    j = np.searchsorted(t, t[-n:] - window, 'left')
+    dt = t[-n:] - t[j]
+    ok = dt >= window / 2.0
+    rate[seen] = np.where(ok, (v[-n:] - v[j]) / np.where(ok, dt, 1.0), 0.0)
+    keep = np.searchsorted(t, t[-1] - window, 'left')
+    return rate, (t[keep:], v[keep:])
+
+def altitudeOf(state, t, press, temp, P0=p0):
+    return hypsometricFormula(P0 / 100.0, press, temp + 273.15)
+
+def rateOf(window):
+    def formula(state, t, v):
+        result, state['tail'] = slope(state.get('tail'), t, v, window)
+        return result
+    return formula
+
+class AltitudeFilter():
+    # Kalman filter on (altitude, vertical speed) from the barometric
+    # altitude, with the vertical acceleration (m/s2, gravity removed) as
+    # the control input when there is one. sigmaAlt is the altitude noise
+    # in m, sigmaAccel the unmodelled acceleration allowed for; readings
+    # more than `gate` sigmas off the prediction are ignored, and after
+    # `restart` of them in a row the filter starts again from the reading.
+    # Missing altitudes only carry the prediction forward; a missing
+    # acceleration counts as none.
+    def __init__(self, sigmaAlt=1.0, sigmaAccel=2.0, gate=5.0, restart=20):
+        self.r = sigmaAlt ** 2
+        self.q = sigmaAccel ** 2
+        self.gate = gate ** 2
+        self.restart = restart
+        self.rejected = 0
+        self.last = None
+        self.x = (0.0, 0.0)
+        self.p = (0.0, 0.0, 0.0)
+
+    def run(self, t, z, a=None):
+        # Arrays in, (altitude, speed, altitude sigma) arrays out. Each
+        # sample is a fixed amount of work and the state carries over
+        # between calls, so a session can be fed in chunks of any size.
+        t = np.asarray(t, dtype=float).tolist()
+        z = np.asarray(z, dtype=float).tolist()
+        a = [0.0] * len(t) if a is None else np.asarray(a, dtype=float).tolist()
+        r, q, gate, restart, last = self.r, self.q, self.gate, self.restart, self.last
+        rejected = self.rejected
+        h, v = self.x
+        p00, p01, p11 = self.p
+        hs, vs, sigmas = [], [], []
+        inf = float('inf')
+        for ti, zi, ai in zip(t, z, a):
+            seen = -inf < zi < inf
+            if not -inf < ai < inf:
+                ai = 0.0
+            if last is None and not seen:
+                hs.append(np.nan)
+                vs.append(np.nan)
+                sigmas.append(np.nan)
+                continue
+            if last is None or (seen and rejected >= restart):
+                h, v = zi, 0.0
+                p00, p01, p11 = r, 0.0, 100.0
+                rejected = 0
+            else:
+                dt = ti - last
+                if dt > 0:
+                    dt2 = dt * dt
+                    h += (v + 0.5 * ai * dt) * dt
+                    v += ai * dt
+                    p00 += dt * (2 * p01 + dt * p11) + q * dt2 * dt2 / 4
+                    p01 += dt * p11 + q * dt2 * dt / 2
+                    p11 += q * dt2
+                if seen:
+                    e = zi - h
+                    s = p00 + r
+                    if e * e <= gate * s:
+                        k0 = p00 / s
+                        k1 = p01 / s
+                        h += k0 * e
+                        v += k1 * e
+                        p11 -= k1 * p01
+                        p01 -= k0 * p01
+                        p00 -= k0 * p00
+                        rejected = 0
+                    else:
+                        rejected += 1
+            last = ti
+            hs.append(h)
+            vs.append(v)
+            sigmas.append(p00)
+        self.last = last
+        self.rejected = rejected
+        self.x = (h, v)
+        self.p = (p00, p01, p11)
+        return np.array(hs), np.array(vs), np.sqrt(sigmas)
+
+def estimateOf(state, t, alt, accel=None, sigmaAlt=1.0, sigmaAccel=2.0):
+    # estAlt runs the filter; estSpeed and estSigma pick up its other outputs
+    if 'filter' not in state:
+        state['filter'] = AltitudeFilter(sigmaAlt, sigmaAccel)
+    h, state['speed'], state['sigma'] = state['filter'].run(t, alt, accel)
+    return h
+
+def setP0(P0):
+    # Reference pressure in Pa for the altitude channel and the pressure
+    # plot's altitude scale
+    channelIndex['alt'].params['P0'] = P0
+    channelIndex['press'].transforms['m'] = Affine(100.0).then(Barometric(P0))
+    conversions.clear()
+
+def setEstimate(sigmaAlt=None, sigmaAccel=None):
+    # Boards with an accelerometer register an 'accel' sensor (vertical,
+    # m/s2, gravity removed) before opening their sources, and the
+    # estimate then follows it closely. The sigmas override the tuning.
+    estimate = channelIndex['estAlt']
+    fused = 'accel' in channelIndex
+    estimate.inputs = ('alt', 'accel') if fused else ('alt',)
+    estimate.params = {'sigmaAlt' : 1.0, 'sigmaAccel' : 0.5 if fused else 2.0}
+    if sigmaAlt is not None:
+        estimate.params['sigmaAlt'] = sigmaAlt
+    if sigmaAccel is not None:
+        estimate.params['sigmaAccel'] = sigmaAccel
+
+register(Derived('alt', 'Altitude', ('press', 'temp'), altitudeOf, 'm', 'm', (
+    ('m', 'Metres', Affine(), (-500, 2000)),
+    ('ft', 'Feet', Affine(3.28084), (-1640, 6560))),
+    colour='#ff00ff', params={'P0' : p0}))
+register(Derived('vspeed', 'Vertical speed', ('alt',), rateOf(1.0), 'm/s', 'm/s', (
+    ('m/s', 'm/s', Affine(), (-30, 30)),
+    ('km/h', 'km/h', Affine(3.6), (-108, 108))),
+    colour='#ffff00', short='V. speed'))
+register(Derived('pollRate', 'Dust rate', ('poll',), rateOf(1.0), 'pcs/L/s', 'pcs/L/s', (
+    ('pcs/L/s', 'pcs/L/s', Affine(), (-5000, 5000)),),
+    colour='#00ffff'))
+
+# Inputs and tuning are picked by setEstimate() once every sensor is in
+register(Derived('estAlt', 'Est. altitude', ('alt',), estimateOf, 'm', 'm', (
+    ('m', 'Metres', Affine(), (-500, 2000)),
+    ('ft', 'Feet', Affine(3.28084), (-1640, 6560))),
+    colour='#ff80ff', params={'sigmaAlt' : 1.0, 'sigmaAccel' : 2.0}, group='estimate', axis='Altitude', short='Est. alt.'))
+register(Derived('estSpeed', 'Est. vertical speed', ('estAlt',), lambda state, t, h: state['speed'], 'm/s', 'm/s', (
+    ('m/s', 'm/s', Affine(), (-30, 30)),
+    ('km/h', 'km/h', Affine(3.6), (-108, 108))),
+    colour='#ffff80', group='estimate', axis='Vertical speed', short='Est. speed'))
+register(Derived('estSigma', 'Altitude uncertainty', ('estAlt',), lambda state, t, h: state['sigma'], 'm', 'm', (
+    ('m', 'Metres', Affine(), (0, 5)),),
+    colour='#c0c0c0', group='estimate', short='Alt. sigma'))
+
+def setGlobals(data):
+    # Globals are kept in the database units: K, Pa, pcs/L, m
+    for channel, value in zip(registry, data):
+        setattr(Globals, channel.name, channel.storing()(value))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Writes a recorded session out as columns for analysis tools
+#
+#     python export.py OUT.npz [--db FILE] [--session ID] [--start T] [--end T]
+#                      [--channels temp press] [--bucket S [--agg avg]] [--step N]
+import sys
+import argparse
+from core import *
+
+def parseOptions(argv):
+    parser = argparse.ArgumentParser(prog='export')
+    parser.add_argument('output', help='.npz, .parquet (pyarrow) or .h5 (h5py)')
+    parser.add_argument('--db', default=db_path, help='database to read')
+    parser.add_argument('--session', type=int, help='session id, the last one by default')
+    parser.add_argument('--start', type=float, help='epoch seconds to start from')
+    parser.add_argument('--end', type=float, help='epoch seconds to stop before')
+    parser.add_argument('--channels', nargs='+', choices=channelNames())
+    parser.add_argument('--bucket', type=float, help='aggregate over buckets of this many seconds')
+    parser.add_argument('--agg', default='avg', choices=Records.aggregates)
+    parser.add_argument('--step', type=int, default=1, help='keep every N-th row')
+    return parser.parse_args(argv)
+
+def main(argv):
+    options = parseOptions(argv)
+    if options.step < 1:
+        print 'step must be at least 1'
+        return 1
+    try:
+        records = Records(options.db)
+    except ValueError as e:
+        print e
+        return 1
+    try:
+        rows = exportSession(records, options.output, options.session, options.start, options.end,
+                             options.channels, options.bucket, options.agg, options.step)
+    except (ImportError, ValueError) as e:
+        print e
+        return 1
+    finally:
+        records.close()
+    print 'Exported %d rows to %s' %(rows, options.output)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Acquisition and recording without Qt, for unattended ground stations
+import sys
+import time
+import signal
+from core import *
+
+status_interval = 10.0
+# Drains hand the writer its rows and the alarm rules their frames, so
+# they run on the frame period whatever the status interval
+drain_interval = delta_t
+# Frames kept per source. Nothing is plotted here, the store only has to
+# hold what the alarm rules have not seen yet: a few drains' worth
+frame_capacity = 8192
+
+def parseOptions(argv):
+    parser = sourceParser('8SpaceDataProcessor-headless')
+    parser.add_argument('--db', default=db_path, help='database to record into')
+    parser.add_argument('--status', type=float, default=status_interval,
+                        help='seconds between status lines, 0 to disable')
+    parser.add_argument('--log', default=log_path, help='rotating log file')
+    return parser.parse_args(argv)
+
+def report(source, count, data, elapsed):
+    setGlobals(data)
+    print '%s  %-10s %d samples (%.1f/s)  T %.2f K  P %.0f Pa  Alt %.1f+-%.1f m  V %.1f m/s  Dust %.0f pcs/L' \
+        %(time.strftime('%Y-%m-%d %H:%M:%S'), source, count, count / elapsed,
+          Globals.temp, Globals.press, Globals.estAlt, Globals.estSigma, Globals.estSpeed, Globals.poll)
+
+def main(argv):
+    options = parseOptions(argv)
+    try:
+        sources = openSources(options)
+    except ValueError as e:
+        print e
+        return 1
+    stream = SampleStream(sources, frame_capacity)
+    sqlite = SQLite(stream.subscribe(), path=options.db)
+    alarms = AlarmEngine(alarm_rules)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print '8SpaceDataProcessor V.%s headless, recording into %s' %(VERSION, options.db)
+    log.open(options.log)
+    server = serveMetrics(options)
+    sqlite.start()
+    stream.start()
+
+    last = time.time()
+    links = dict([(source.id, source.linkState) for source in sources])
+    # Samples per source since the last status line
+    counts = {}
+    try:
+        while True:
+            time.sleep(drain_interval)
+            for sample in stream.drain():
+                counts[sample[2]] = counts.get(sample[2], 0) + 1
+            for event in alarms.update(stream):
+                sqlite.alarm(event)
+            for source in sources:
+                if source.linkState != links[source.id]:
+                    links[source.id] = source.linkState
+                    log.message('%s link %s' %(source.id, source.linkState))
+            log.expire()
+
+            now = time.time()
+            if options.status and now - last >= options.status:
+                if counts:
+                    for source in sources:
+                        if source.id in stream.latest:
+                            report(source.id, counts.get(source.id, 0), stream.latest[source.id], now - last)
+                    sys.stdout.flush()
+                counts = {}
+                last = now
+
+            if isinstance(sources[0], Replay) and not sources[0].comStatus:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # The last drain hands the writer whatever the readers queued
+        stream.stop()
+        stream.drain()
+        sqlite.stop()
+        if server is not None:
+            server.stop()
+        log.close()
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -10,139 +10,136 @@ import time
 import random
 import math
 import logging
+import collections
 from PySide import QtGui, QtCore, QtWebKit
 from PySide.QtOpenGL import *
 import numpy as np
 import pyqtgraph as pg
+from core import *
 
 pg.setConfigOptions(antialias=True)
 
-VERSION = '1.0.0'
 max_graph_length = 18
 delta_s = 100
 dn = 3
-
-class Globals():
-    temp = 0.1
-    press = 0.1
-    poll = 0.1
-    accel = [0.1, 0.1, 0.1]
+frame_min = 1 / 60.0
+frame_max = 0.5
+frame_budget = 0.3
+label_interval = 0.1
 
 class Timing():
     timer = QtCore.QTimer()
     slowTimer = QtCore.QTimer()
-    passiveTimer = QtCore.QTimer()
+
+# Made by setup() before any widget, so importing this module opens nothing
+options = None
+sources = []
+arduino = None
+stream = None
+alarms = None
+statusModel = None
+
+def setup(argv):
+    global options, sources, arduino, stream, alarms, statusModel
+    # Qt options are left in argv for QApplication
+    options = sourceParser().parse_known_args(argv)[0]
+    sources = openSources(options)
+    arduino = sources[0]
+    stream = SampleStream(sources)
+    alarms = AlarmEngine(alarm_rules)
+    statusModel = StatusModel(arduino, alarms)
 
 # ----------------------------------------------------------------------
-# Utils
+# Scheduling
 # ----------------------------------------------------------------------
 
-class Notice():
-    def __init__(self):
-        self.allId = {}
-        Timing.passiveTimer.timeout.connect(self.reset)
+def visible(widget):
+    return widget.isVisible() and not widget.window().isMinimized() and \
+        not widget.visibleRegion().isEmpty()
+
+class FrameScheduler(QtCore.QObject):
+    # One frame: sigFrame lets consumers take in new data, then pending
+    # redraws run once each, skipping widgets that can't be seen. The next
+    # frame is spaced so drawing takes about frame_budget of the GUI thread;
+    # when a frame brought nothing to redraw the spacing doubles up to
+    # maxInterval, waking early only for a recurring label that is due.
+    sigFrame = QtCore.Signal()
+
+    def __init__(self, minInterval=frame_min, maxInterval=frame_max, budget=frame_budget):
+        super(FrameScheduler, self).__init__()
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.budget = budget
+        self.interval = minInterval
+        self.pending = collections.OrderedDict()
+        self.recurring = []
+        self.requested = False
+        self.cost = EWMA(0.2)
+        self.paintCost = 0.0
 
-    def defineNotice(self, text):
-        self.allId[text[0:3]] = 0
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.frame)
 
-    def notice(self, text):
-        try:
-            key = text[0:3]
-            if self.allId[key] == 0:
-                print text
-                self.allId[key] = 1
-        except KeyError:
-            self.defineNotice(text)
+    def start(self):
+        self.timer.start(0)
 
-    def reset(self):
-        self.allId = {}
+    def request(self, widget, callback):
+        # Several requests for the same redraw before a frame run once
+        self.pending[(widget, callback)] = None
+        self.requested = True
 
-notice = Notice()
+    def every(self, widget, callback, period=label_interval):
+        # callback(widget) at most once per period, on the next frame after
+        self.recurring.append([widget, callback, period, 0.0])
 
-# ----------------------------------------------------------------------
-# Input
-# ----------------------------------------------------------------------
+    def due(self):
+        # Seconds until the next visible recurring callback wants to run
+        due = [entry[3] for entry in self.recurring if visible(entry[0])]
+        if not due:
+            return self.maxInterval
+        return min(due) - time.time()
 
-class Arduino():
-    def __init__(self):
-        self.NP = '-1'
-        self.data = [0.1, 0.1, 0.1]
-        self.tempStatus = False
-        self.pressStatus = False
-        self.pollStatus = False
-        self.debugMode = False
-        self.comStatus = False
-        try:
-            self.connect()
-            self.comStatus = True
-        except Exception as e:
-            print e
-            self.debugMode = True
-
-    def findPort(self, device="Arduino Leonardo"):
-        ports = list(serial.tools.list_ports.comports())
-        for port in ports:
-            port = str(port)
-            if device in port:
-                np = filter(str.isdigit, port.split(' ')[0])
-                self.NP = np
-
-    def connect(self):
-        self.findPort()
-        self.arduino = serial.Serial('COM' + self.NP, 9600, timeout=0)
-
-    def retryConn(self):
-        self.arduino.close()
-        for x in xrange(1):
-            try:
-                self.connect()
-                self.comStatus = True
-                print '00B-Signal found'
-                break
-            except:
-                continue
+    def addPaintCost(self, cost):
+        self.paintCost += cost
 
-    def getData(self, i):
-        if not self.debugMode:
-            try:
-                output = self.arduino.readline().strip()
-            except:
-                notice.notice('00A-Lost signal')
-                self.tempStatus = False
-                self.pressStatus = False
-                self.pollStatus = False
-                self.comStatus = False
-                self.retryConn()
-                return self.data
-
-            if len(output) > 2:
-                data = output.split(',')
-
-                try:
-                    temp = float(data[0])
-                    self.tempStatus = True
-                except:
-                    temp = 0.1
-                    self.tempStatus = False
-
-                try:
-                    press = float(data[1])
-                    self.pressStatus = True
-                except:
-                    press = 0.1
-                    self.pressStatus = False
-
-                try:
-                    poll = float(data[2])
-                    self.pollStatus = True
-                except:
-                    poll = 0.1
-                    self.pollStatus = False
-
-                self.data = [temp, press, poll]
-        return self.data
-
-arduino = Arduino()
+    def flush(self):
+        now = time.time()
+        for entry in self.recurring:
+            widget, callback, period, due = entry
+            if now >= due and visible(widget):
+                entry[3] = now + period
+                self.run(widget, callback)
+        for key in self.pending.keys():
+            widget, callback = key
+            if visible(widget):
+                del self.pending[key]
+                self.run(widget, callback)
+
+    def run(self, widget, callback):
+        start = time.time()
+        callback(widget)
+        metrics.histogram('widget_seconds', widget=type(widget).__name__).observe(time.time() - start)
+
+    def frame(self):
+        start = time.time()
+        self.requested = False
+        self.sigFrame.emit()
+        self.flush()
+
+        # Painting happens after this returns, so its cost counts next frame
+        self.cost.push(time.time() - start + self.paintCost)
+        metrics.histogram('frame_seconds').observe(time.time() - start + self.paintCost)
+        self.paintCost = 0.0
+        if self.requested:
+            self.interval = min(max(self.cost.value / self.budget, self.minInterval), self.maxInterval)
+        else:
+            idle = min(self.interval * 2, self.maxInterval, self.due())
+            self.interval = max(idle, self.minInterval)
+        self.timer.start(int(self.interval * 1000))
+        metrics.gauge('frame_interval_seconds').set(self.interval)
+
+scheduler = FrameScheduler()
 
 # ----------------------------------------------------------------------
 # Logging
@@ -163,9 +160,9 @@ logger.addHandler(handler)
 logger.setLevel(logging.DEBUG)
 
 class XStream(QtCore.QObject):
+    # stdout and stderr go to the log sink, which LogsBox reads once a frame
     _stdout = None
     _stderr = None
-    messageWritten = QtCore.Signal(str)
 
     def flush(self):
         pass
@@ -174,8 +171,7 @@ class XStream(QtCore.QObject):
         return -1
 
     def write(self, msg):
-        if not self.signalsBlocked():
-            self.messageWritten.emit(unicode(msg))
+        log.write(unicode(msg))
 
     @staticmethod
     def stdout():
@@ -197,11 +193,20 @@ class LogsBox(QtGui.QTextBrowser):
         self.document().setMaximumBlockCount(10000)
 
         self.oldMax = self.verticalScrollBar().value()
+        self.seq = 0
 
-        Timing.timer.timeout.connect(self.update)
+        scheduler.every(self, LogsBox.update)
 
     def update(self):
-        if self.verticalScrollBar().value() >= self.oldMax:
+        # Everything logged since the last frame goes in as one edit
+        self.seq, lines = log.since(self.seq)
+        if not lines:
+            return
+        follow = self.verticalScrollBar().value() >= self.oldMax
+        cursor = self.textCursor()
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.insertText('\n'.join(lines) + '\n')
+        if follow:
             self.autoscroll()
             self.oldMax = self.verticalScrollBar().value()
 
@@ -218,80 +223,124 @@ class Logger(QtGui.QWidget):
         layout.addWidget(self.logsBox)
         self.setLayout(layout)
 
-        XStream.stdout().messageWritten.connect(self.logsBox.insertPlainText)
-        XStream.stderr().messageWritten.connect(self.logsBox.insertPlainText)
+        XStream.stdout()
+        XStream.stderr()
 
 # ----------------------------------------------------------------------
-# Data recording
+# Metrics
 # ----------------------------------------------------------------------
 
-class SQLite():
-    def __init__(self):
-        self.conn = sqlite3.connect('cansat-records-strv%s.db' %(VERSION))
-        self.c = self.conn.cursor()
-
-        try:
-            self.c.execute('CREATE TABLE temp(date datetime, value real, um text)')
-        except sqlite3.OperationalError:
-            pass
-
-        try:
-            self.c.execute('CREATE TABLE press(date datetime, value real, um text)')
-        except sqlite3.OperationalError:
-            pass
-
-        try:
-            self.c.execute('CREATE TABLE poll(date datetime, value real, um text)')
-        except sqlite3.OperationalError:
-            pass
-
-    def addRecords(self):
-        self.time = time.strftime('%Y-%m-%d %H:%M:%S')
-        self.c.execute("INSERT INTO temp VALUES (?, ?, 'K')", (self.time, format(Globals.temp, '.3f')))
-        self.c.execute("INSERT INTO press VALUES (?, ?, 'Pa')", (self.time, Globals.press))
-        self.c.execute("INSERT INTO poll VALUES (?, ?, 'pcs/L')", (self.time, Globals.poll))
-        self.conn.commit()
-
-    def close(self):
-        self.conn.close()
-# ----------------------------------------------------------------------
-# Math Tools
-# ----------------------------------------------------------------------
+def metricsCells(row):
+    # Durations are shown in ms, p50/p99 as bucket upper bounds
+    name, kind, value, rate, p50, p99 = row
+    cells = [name, kind, '%d' %(value) if kind != 'gauge' else '%.3f' %(value)]
+    cells.append('' if rate is None else '%.1f' %(rate))
+    for q in (p50, p99):
+        cells.append('' if q is None else '<%.3g ms' %(q * 1000.0))
+    return cells
 
-def interquartileMean(l):
-    l = sorted(l)
-    n = len(l)
-    mean = 2.0/n * sum([l[int(round(n/4.0+x))] for x in xrange(int(round(3.0*n/6.0)))])
-    return mean
+class MetricsModel(QtCore.QAbstractTableModel):
+    headers = ('Series', 'Kind', 'Value', 'Per s', 'p50', 'p99')
 
-# ----------------------------------------------------------------------
-# Tools
-# ----------------------------------------------------------------------
+    def __init__(self):
+        super(MetricsModel, self).__init__()
+        self.texts = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.texts)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if index.isValid() and role == QtCore.Qt.DisplayRole:
+            return self.texts[index.row()][index.column()]
+        return None
+
+    def refresh(self):
+        texts = [metricsCells(row) for row in metrics.rows()]
+        if len(texts) != len(self.texts):
+            # New series showed up
+            self.beginResetModel()
+            self.texts = texts
+            self.endResetModel()
+        elif texts != self.texts:
+            self.texts = texts
+            self.dataChanged.emit(self.index(0, 0), self.index(len(texts) - 1, len(self.headers) - 1))
+
+class MetricsView(QtGui.QTableView):
+    def __init__(self):
+        super(MetricsView, self).__init__()
+        self.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.verticalHeader().setVisible(False)
+        self.metricsModel = MetricsModel()
+        self.setModel(self.metricsModel)
 
-def meanList(self, k):
-    l = self.meanList
-    l.append(k)
-    self.mean = np.mean(l)
+        Timing.slowTimer.timeout.connect(self.refresh)
+
+    def refresh(self):
+        if visible(self):
+            self.metricsModel.refresh()
+            self.resizeColumnsToContents()
 
 # ----------------------------------------------------------------------
 # Update
 # ----------------------------------------------------------------------
 
+@metrics.timed('update_seconds')
 def update(self):
-    now = time.clock()
-    data = eval(self.scale %(float(arduino.getData(0)[self.ind])))
-    self.array[self.p+1, 0] = now
-    self.array[self.p+1, 1] = data
-    self.curve.setData(x=self.array[:self.p+2:, 0], y=self.array[:self.p+2, 1])
-    self.p += 1
-    self.data[0] = data
-
+    if not stream.fresh:
+        return
+    # Frames and statistics stay in the Arduino's units, self.display
+    # converts only what is shown
+    self.lod.update()
+    self.stats.extend(stream.frames.recent(self.quantity, stream.fresh))
+    self.data[0] = self.display(stream.frames.last(self.quantity))
+    scheduler.request(self, render)
+
+@metrics.timed('render_seconds')
+def render(self):
+    bounds = self.lod.bounds()
+    if bounds is None:
+        return
+    viewBox = self.getViewBox()
+    if not viewBox.autoRangeEnabled()[0]:
+        # The plot's x axis counts from stream.t0, the frames from the epoch
+        bounds = [x + stream.t0 for x in viewBox.viewRange()[0]]
+    width = max(int(viewBox.width()), 1)
+    x, y = self.lod.select(bounds[0], bounds[1], width)
+    # Missing values break the curve instead of joining across them
+    self.curve.setData(x=x - stream.t0, y=self.display(y), connect='finite')
+
+def viewChanged(self):
+    # Zoom and pan re-select the level; auto-range follows update() instead
+    if not self.getViewBox().autoRangeEnabled()[0]:
+        render(self)
+
+@metrics.timed('mean_update_seconds')
 def meanUpdate(self):
-    now = time.clock()
-    self.mArray[self.m_p+1, 0] = now
-    self.mArray[self.m_p+1, 1] = self.mean
-    self.mCurve.setData(x=self.mArray[:self.m_p+2:, 0], y=self.mArray[:self.m_p+2, 1])
-    self.m_p += 1
+    now = time.time() - stream.t0
+    self.mArray.append((now, self.stats.value(self.meanStat)))
+    scheduler.request(self, meanRender)
+
+@metrics.timed('mean_render_seconds')
+def meanRender(self):
+    view = self.mArray.view()
+    if len(view):
+        self.mean = self.display(view[-1, 1])
+    self.mCurve.setData(x=view[:, 0], y=self.display(view[:, 1]))
+
+def paint(self, ev):
+    start = time.time()
+    pg.PlotWidget.paintEvent(self, ev)
+    cost = time.time() - start
+    scheduler.addPaintCost(cost)
+    metrics.histogram('paint_seconds').observe(cost)
 
 # ----------------------------------------------------------------------
 # Top bar widget
@@ -300,93 +349,122 @@ def meanUpdate(self):
 WORKING_COLOR = '#090'
 ERROR_COLOR = '#f00'
 
+class StatusModel(QtCore.QObject):
+    # Link and sensor state of the source, polled once per tick. Widgets
+    # are only told about transitions, so restyling happens when a sensor
+    # actually drops out or comes back rather than on every tick.
+    sigChanged = QtCore.Signal(str, bool)
+    # Reconnect progress: connected, lost, waiting, debug
+    sigLink = QtCore.Signal(str, str)
+    # Names of the alarms currently raised
+    sigAlarms = QtCore.Signal(list)
+
+    def __init__(self, source, alarms):
+        super(StatusModel, self).__init__()
+        self.source = source
+        self.alarms = alarms
+        self.state = {}
+        self.link = None
+        self.raised = []
+
+    def poll(self):
+        source = self.source
+        link = (source.NP, source.linkState)
+        if link != self.link:
+            self.link = link
+            self.sigLink.emit(*link)
+
+        raised = self.alarms.active()
+        if raised != self.raised:
+            self.raised = raised
+            self.sigAlarms.emit(raised)
+
+        state = dict(source.status)
+        state['link'] = bool(source.comStatus) and not source.debugMode
+        state['all'] = all(state.values())
+        for key, value in state.items():
+            if self.state.get(key) != value:
+                self.state[key] = value
+                self.sigChanged.emit(key, value)
+
+    def watch(self, key, callback):
+        # callback(ok) now and on every later transition of key
+        def changed(name, value):
+            if name == key:
+                callback(value)
+        self.sigChanged.connect(changed)
+        if key in self.state:
+            callback(self.state[key])
+
+def statusStyles(name):
+    return {
+        True : '.%s{color:%s;}' %(name, WORKING_COLOR),
+        False : '.%s{color:%s;}' %(name, ERROR_COLOR)
+    }
+
+class StatusLabel(QtGui.QLabel):
+    def __init__(self, text, key):
+        super(StatusLabel, self).__init__()
+        self.setText(text)
+        self.styles = statusStyles(type(self).__name__)
+
+        statusModel.watch(key, self.update)
+
+    def update(self, ok):
+        self.setStyleSheet(self.styles[ok])
+
 class StatusViewer(QtGui.QLabel):
     def __init__(self):
         super(StatusViewer, self).__init__()
-        self.image = ''
-
-        Timing.slowTimer.timeout.connect(self.update)
-
-    def update(self):
-        imgTemp = self.image
-        if arduino.debugMode == True or \
-            arduino.tempStatus == False or \
-            arduino.pressStatus == False or \
-            arduino.pollStatus == False or \
-            arduino.comStatus == False:
-            self.image = 'media\\red_led.png'
-        else:
-            self.image = 'media\\green_led.png'
-
-        if imgTemp != self.image:
-            self.setText('<img src="%s"> &nbsp; Status' %(self.image))
-
-class SerialViewer(QtGui.QLabel):
-    def __init__(self):
-        super(SerialViewer, self).__init__()
-        self.setText('COM: ' + arduino.NP)
+        self.texts = {
+            True : '<img src="media\\green_led.png"> &nbsp; Status',
+            False : '<img src="media\\red_led.png"> &nbsp; Status'
+        }
 
-        Timing.timer.timeout.connect(self.update)
+        statusModel.watch('all', self.update)
 
-    def update(self):
-        npTemp = arduino.NP
-        if arduino.debugMode == False and arduino.comStatus == True:
-            self.setStyleSheet('.SerialViewer{color:%s;}' %(WORKING_COLOR))
-        else:
-            self.setStyleSheet('.SerialViewer{color:%s;}' %(ERROR_COLOR))
+    def update(self, ok):
+        self.setText(self.texts[ok])
 
-        """if imgTemp != arduino.NP:
-            self.setText('COM: ' + arduino.NP)"""
-
-class TempViewer(QtGui.QLabel):
+class SerialViewer(StatusLabel):
     def __init__(self):
-        super(TempViewer, self).__init__()
-        self.setText('BMP180 - Temp')
+        super(SerialViewer, self).__init__('COM: ' + arduino.NP, 'link')
 
-        Timing.timer.timeout.connect(self.update)
+        statusModel.sigLink.connect(self.linkChanged)
 
-    def update(self):
-        if arduino.tempStatus == False:
-            self.setStyleSheet('.TempViewer{color:%s;}' %(ERROR_COLOR))
+    def linkChanged(self, port, state):
+        if state in ('connected', 'replay'):
+            self.setText('COM: ' + port)
         else:
-            self.setStyleSheet('.TempViewer{color:%s;}' %(WORKING_COLOR))
-
-class PressViewer(QtGui.QLabel):
-    def __init__(self):
-        super(PressViewer, self).__init__()
-        self.setText('BMP180 - Press')
-
-        Timing.timer.timeout.connect(self.update)
+            self.setText('COM: %s (%s)' %(port, state))
 
-    def update(self):
-        if arduino.pressStatus == False:
-            self.setStyleSheet('.PressViewer{color:%s;}' %(ERROR_COLOR))
-        else:
-            self.setStyleSheet('.PressViewer{color:%s;}' %(WORKING_COLOR))
+class SensorViewer(StatusLabel):
+    def __init__(self, channel):
+        super(SensorViewer, self).__init__(channel.sensor or channel.label, channel.name)
 
-class PollViewer(QtGui.QLabel):
+class AlarmViewer(QtGui.QLabel):
     def __init__(self):
-        super(PollViewer, self).__init__()
-        self.setText('PPD42NS - Dust concn')
+        super(AlarmViewer, self).__init__()
+        self.styles = statusStyles(type(self).__name__)
+        self.update([])
 
-        Timing.timer.timeout.connect(self.update)
+        statusModel.sigAlarms.connect(self.update)
 
-    def update(self):
-        if arduino.pollStatus == False:
-            self.setStyleSheet('.PollViewer{color:%s;}' %(ERROR_COLOR))
-        else:
-            self.setStyleSheet('.PollViewer{color:%s;}' %(WORKING_COLOR))
+    def update(self, raised):
+        self.setText('Alarms: ' + (', '.join(raised) if raised else 'none'))
+        self.setStyleSheet(self.styles[not raised])
 
 class DateTimeViewer(QtGui.QLabel):
     def __init__(self):
         super(DateTimeViewer, self).__init__()
+        self.zone = tzlocal.get_localzone()
         self.time = 'Date: &nbsp; Time: '
         self.setText(self.time)
 
-        Timing.timer.timeout.connect(self.update)
+        scheduler.every(self, DateTimeViewer.update)
 
     def update(self):
-        now = datetime.now(tzlocal.get_localzone())
+        now = datetime.now(self.zone)
         self.time = now.strftime('Date: %Y-%m-%d &nbsp; Time: %H:%M:%S')
         self.millis = now.strftime('.%f ')[:-4]
         self.tz = now.strftime('%z')
@@ -399,7 +477,7 @@ class ETViewer(QtGui.QLabel):
         self.text = 'Elapsed time: %.3f s'
         self.setText(self.text)
 
-        Timing.timer.timeout.connect(self.update)
+        scheduler.every(self, ETViewer.update)
 
     def update(self):
         et = round(time.time() - self.sTime, 3)
@@ -421,17 +499,16 @@ class TopBar(QtGui.QFrame):
         self.serialViewer = SerialViewer()
         self.dateTimeViewer = DateTimeViewer()
         self.etViewer = ETViewer()
-        self.tempViewer = TempViewer()
-        self.pressViewer = PressViewer()
-        self.pollViewer = PollViewer()
+        self.sensorViewers = [SensorViewer(channel) for channel in sensors]
+        self.alarmViewer = AlarmViewer()
 
         self.layout.addWidget(self.statusViewer, 0, 0)
         self.layout.addWidget(self.serialViewer, 0, 1)
         self.layout.addWidget(self.dateTimeViewer, 0, 2)
         self.layout.addWidget(self.etViewer, 0, 3)
-        self.layout.addWidget(self.tempViewer, 0, 4)
-        self.layout.addWidget(self.pressViewer, 0, 5)
-        self.layout.addWidget(self.pollViewer, 0, 6)
+        for i, viewer in enumerate(self.sensorViewers):
+            self.layout.addWidget(viewer, 0, 4 + i)
+        self.layout.addWidget(self.alarmViewer, 0, 4 + len(self.sensorViewers))
         self.setLayout(self.layout)
 
 class LockOpt(QtGui.QCheckBox):
@@ -477,70 +554,44 @@ class ResetView(QtGui.QPushButton):
 # ----------------------------------------------------------------------
 
 def changeScale(self):
-    graph = eval(self.graph)
-    graph.scale = 'self.' + self.currentText().lower() + '(%s)'
-    graph.setLabel('left', graph.name, self.currentText()[0])
-    yRange = (self.deltas[self.currentText()[0]][0], self.deltas[self.currentText()[0]][1])
+    graph = self.graph
+    channel = graph.channel
+    unit = channel.unitNames()[self.currentIndex()]
+    graph.unit = unit
+    graph.display = conversion(graph.quantity, channel.base, unit)
+    graph.setLabel('left', channel.axisName(unit), unit)
+    yRange = channel.ranges[unit]
     graph.setYRange(yRange[0], yRange[1])
 
     graph.yRange = (yRange[0], yRange[1])
 
-    graph.data[1] = self.currentText()[0]
-
-    graph.changed = 0
-
-    if self.hasMean == True:
-        convertMean(self, graph)
-
-    # Adjusting graph
-    convertGraph(self, graph.curve, graph)
-    convertGraph(self, graph.mCurve, graph)
-
-    self.prevScale = self.currentText()[0]
+    graph.data[1] = unit
 
-def convertGraph(self, curve, graph):
-    array = curve.getData()
-    for i, y in enumerate(array[1]):
-        array[1][i] = eval(self.convert[self.prevScale + self.currentText()[0]].format(y))
-    curve.setData(x=array[0], y=array[1])
-
-def convertMean(self, graph):
-    for i, v in enumerate(graph.meanList):
-        graph.meanList[i] = eval(self.convert[self.prevScale + self.currentText()[0]].format(v))
+    # Only the points on screen are converted again
+    render(graph)
+    if channel.mean == True:
+        meanRender(graph)
 
 # ----------------------------------------------------------------------
-# Temperature
+# Channels
 # ----------------------------------------------------------------------
 
-class ChangeTempUM(QtGui.QComboBox):
-    def __init__(self):
-        super(ChangeTempUM, self).__init__()
-        self.addItems(('Kelvin', 'Celsius', 'Fahrenheit'))
+class ChangeUM(QtGui.QComboBox):
+    def __init__(self, graph):
+        super(ChangeUM, self).__init__()
+        self.addItems([unit[1] for unit in graph.channel.units])
         self.setMaximumWidth(120)
 
-        self.graph = 'window.mainWidget.mainLayout.plottingFrame.plottingLayout.tempGraph'
-        self.hasMean = True
-
-        self.prevScale = 'K'
-        self.deltas = {'K' : (290, 310), 'C' : (17, 37), 'F' : (62, 98)}
-
-        self.convert = {
-            'CK' : '{0} + 273.15',
-            'KC' : '{0} - 273.15',
-            'CF' : '{0} * 1.8 + 32',
-            'FC' : '({0} - 32) / 1.8',
-            'KF' : '({0} - 273.15) * 1.8 + 32',
-            'FK' : '({0} - 32) / 1.8 + 273.15'
-        }
+        self.graph = graph
 
         self.label = QtGui.QLabel()
         self.label.setText('U.M.')
 
         self.currentIndexChanged.connect(lambda: changeScale(self))
 
-class ControlTempLayout(QtGui.QGridLayout):
-    def __init__(self):
-        super(ControlTempLayout, self).__init__()
+class ControlChannelLayout(QtGui.QGridLayout):
+    def __init__(self, graph):
+        super(ControlChannelLayout, self).__init__()
         self.setSpacing(5)
         self.setContentsMargins(10, 10, 10, 10)
         self.setAlignment(QtCore.Qt.AlignTop)
@@ -560,13 +611,12 @@ class ControlTempLayout(QtGui.QGridLayout):
         self.othersLayout.setAlignment(QtCore.Qt.AlignLeft)
         self.othersGroup.setLayout(self.othersLayout)
 
-        temp_path = 'window.mainWidget.mainLayout.plottingFrame.plottingLayout.tempGraph'
-        self.changeTempUM = ChangeTempUM()
-        self.lockOpt = LockOpt(temp_path)
-        self.resetView = ResetView(temp_path)
+        self.changeUM = ChangeUM(graph)
+        self.lockOpt = LockOpt(graph)
+        self.resetView = ResetView(graph)
 
-        self.prefsLayout.addWidget(self.changeTempUM.label, 0, 0)
-        self.prefsLayout.addWidget(self.changeTempUM, 0, 1)
+        self.prefsLayout.addWidget(self.changeUM.label, 0, 0)
+        self.prefsLayout.addWidget(self.changeUM, 0, 1)
         self.optionsLayout.addWidget(self.lockOpt.label, 0, 0)
         self.optionsLayout.addWidget(self.lockOpt, 0, 1)
         self.othersLayout.addWidget(self.resetView, 0, 0)
@@ -575,370 +625,195 @@ class ControlTempLayout(QtGui.QGridLayout):
         self.addWidget(self.optionsGroup)
         self.addWidget(self.othersGroup)
 
-class ControlTemp(QtGui.QTabWidget):
-    def __init__(self):
-        super(ControlTemp, self).__init__()
-        self.controlTempLayout = ControlTempLayout()
-        self.setLayout(self.controlTempLayout)
-
-class TempGraph(pg.PlotWidget):
-    def __init__(self, plotLayout):
-        super(TempGraph, self).__init__()
-        self.setLabel('left', 'Temperature', 'K')
+class ControlChannel(QtGui.QTabWidget):
+    def __init__(self, graph):
+        super(ControlChannel, self).__init__()
+        self.controlLayout = ControlChannelLayout(graph)
+        self.setLayout(self.controlLayout)
+
+class ChannelGraph(pg.PlotWidget):
+    def __init__(self, plotLayout, channel):
+        super(ChannelGraph, self).__init__()
+        self.channel = channel
+        self.unit = channel.units[0][0]
+        self.setLabel('left', channel.axisName(self.unit), self.unit)
         self.setLabel('bottom', 'Time', 's')
         self.addLegend()
 
-        self.yRange = (290, 310)
-
-        self.setView()
-
-        self.meanTimer = QtCore.QTimer()
-        self.meanTimer.start(2000)
-
-        # Identity
-        self.name = 'Temperature'
-        self.setTitle(self.name)
-
-        # Graph vars
-        self.plotLayout = plotLayout
-        self.chunkSize = 150000
-
-        self.array = np.empty((self.chunkSize + 1, 2))
-        self.p = 0
-
-        self.mArray = np.empty((self.chunkSize + 1, 2))
-        self.m_p = 0
-
-        self.ind = 0
-        self.changed = 1
-
-        # Vars
-        self.maxCurves = max_graph_length
-        self.colour = '#ff0000'
-        self.scale = 'self.kelvin(%s)'
-        self.data = [0, 'K']
-
-        self.meanList = []
-        self.mean = 0
-
-        self.curve = self.plot(pen=self.colour, name=self.name)
-        self.mCurve = self.plot(pen=pg.mkPen(color=self.colour, style=QtCore.Qt.DotLine), name='Mean ' + self.name)
-
-    def start(self):
-        # Events
-        Timing.timer.timeout.connect(lambda: update(self))
-        self.meanTimer.timeout.connect(lambda: meanList(self, float(self.data[0])))
-        self.meanTimer.timeout.connect(lambda: meanUpdate(self))
-
-    def setView(self):
-        self.setXRange(0, delta_s)
-        self.setYRange(self.yRange[0], self.yRange[1])
-        self.showGrid(x=1, y=1, alpha=0.35)
-        self.enableAutoRange('x')
-
-    def celsius(self, inpt):
-        if self.changed == 0:
-            self.mean = str(float(self.mean) - 273.15)
-
-            for value in self.meanList:
-                value -= 273.15
-
-            self.changed = 1
-
-        Globals.temp = inpt + 273.15
-
-        return inpt
-
-    def kelvin(self, inpt):
-        if self.changed == 0:
-            self.mean = str(float(self.mean) + 273.15)
-
-            for value in self.meanList:
-                value += 273.15
-
-            self.changed = 1
-
-        Globals.temp = inpt + 273.15
-
-        return inpt + 273.15
-
-    def fahrenheit(self, inpt):
-        if self.changed == 0:
-            self.mean = str(float(self.mean) * 1.8 + 32)
-
-            for value in self.meanList:
-                value = value * 1.8 + 32
-
-            self.changed = 1
-
-        Globals.temp = inpt + 273.15
-
-        return inpt * 1.8 + 32
-
-# ----------------------------------------------------------------------
-# Pressure
-# ----------------------------------------------------------------------
-
-class ControlPressLayout(QtGui.QGridLayout):
-    def __init__(self):
-        super(ControlPressLayout, self).__init__()
-        self.setSpacing(5)
-        self.setContentsMargins(10, 10, 10, 10)
-        self.setAlignment(QtCore.Qt.AlignTop)
-
-        self.optionsGroup = QtGui.QGroupBox('Options')
-        self.optionsLayout = QtGui.QGridLayout()
-        self.optionsLayout.setAlignment(QtCore.Qt.AlignLeft)
-        self.optionsGroup.setLayout(self.optionsLayout)
-
-        self.othersGroup = QtGui.QGroupBox()
-        self.othersLayout = QtGui.QGridLayout()
-        self.othersLayout.setAlignment(QtCore.Qt.AlignLeft)
-        self.othersGroup.setLayout(self.othersLayout)
-
-        temp_path = 'window.mainWidget.mainLayout.plottingFrame.plottingLayout.pressureGraph'
-        self.lockOpt = LockOpt(temp_path)
-        self.resetView = ResetView(temp_path)
-
-        self.optionsLayout.addWidget(self.lockOpt.label, 0, 0)
-        self.optionsLayout.addWidget(self.lockOpt, 0, 1)
-        self.othersLayout.addWidget(self.resetView, 0, 0)
-
-        self.addWidget(self.optionsGroup)
-        self.addWidget(self.othersGroup)
-
-class ControlPressure(QtGui.QTabWidget):
-    def __init__(self):
-        super(ControlPressure, self).__init__()
-        self.controlPressLayout = ControlPressLayout()
-        self.setLayout(self.controlPressLayout)
-
-class PressureGraph(pg.PlotWidget):
-    def __init__(self, plotLayout):
-        super(PressureGraph, self).__init__()
-        self.setLabel('left', 'Pressure', 'Pa')
-        self.setLabel('bottom', 'Time', 's')
-        self.addLegend()
+        self.yRange = channel.ranges[self.unit]
 
         self.setView()
 
         # Identity
-        self.name = 'Pressure'
+        self.name = channel.label
         self.setTitle(self.name)
 
         # Graph vars
         self.plotLayout = plotLayout
-        self.chunkSize = 150000
-        self.array = np.empty((self.chunkSize + 1, 2))
-        self.p = 0
-
-        self.ind = 1
+        self.chunkSize = chunk_size
+        self.lod = MinMaxPyramid(stream.frames, channel.name)
+        # Median and iqm are only kept where a mean curve can show them
+        self.stats = ChannelStats(quantiles=channel.mean)
 
         # Vars
         self.initState = self.saveState()
         self.maxCurves = max_graph_length
-        self.colour = '#00ff00'
-        self.scale = 'self.pascal(%s)'
-        self.data = [0, 'Pa']
+        self.colour = channel.colour
+        self.quantity = channel.name
+        self.display = conversion(self.quantity, channel.base, self.unit)
+        self.data = [0, self.unit]
 
         self.curve = self.plot(pen=self.colour, name=self.name)
 
-    def start(self):
-        # Events
-        Timing.timer.timeout.connect(lambda: update(self))
-
-    def setView(self):
-        self.setXRange(0, delta_s)
-        self.setYRange(80000, 130000)
-        self.showGrid(x=1, y=1, alpha=0.35)
-        self.enableAutoRange('x')
-
-    def pascal(self, inpt):
-        value = inpt * 100
-
-        Globals.press = value
-
-        return value
-
-# ----------------------------------------------------------------------
-# Poll
-# ----------------------------------------------------------------------
-
-class ControlPollLayout(QtGui.QGridLayout):
-    def __init__(self):
-        super(ControlPollLayout, self).__init__()
-        self.setSpacing(5)
-        self.setContentsMargins(10, 10, 10, 10)
-        self.setAlignment(QtCore.Qt.AlignTop)
-
-        self.optionsGroup = QtGui.QGroupBox('Options')
-        self.optionsLayout = QtGui.QGridLayout()
-        self.optionsLayout.setAlignment(QtCore.Qt.AlignLeft)
-        self.optionsGroup.setLayout(self.optionsLayout)
-
-        self.othersGroup = QtGui.QGroupBox()
-        self.othersLayout = QtGui.QGridLayout()
-        self.othersLayout.setAlignment(QtCore.Qt.AlignLeft)
-        self.othersGroup.setLayout(self.othersLayout)
-
-        temp_path = 'window.mainWidget.mainLayout.plottingFrame.plottingLayout.pollGraph'
-        self.lockOpt = LockOpt(temp_path)
-        self.resetView = ResetView(temp_path)
-
-        self.optionsLayout.addWidget(self.lockOpt.label, 0, 0)
-        self.optionsLayout.addWidget(self.lockOpt, 0, 1)
-        self.othersLayout.addWidget(self.resetView, 0, 0)
-
-        self.addWidget(self.optionsGroup)
-        self.addWidget(self.othersGroup)
-
-class ControlPoll(QtGui.QTabWidget):
-    def __init__(self):
-        super(ControlPoll, self).__init__()
-        self.controlPollLayout = ControlPollLayout()
-        self.setLayout(self.controlPollLayout)
-
-class PollGraph(pg.PlotWidget):
-    def __init__(self, plotLayout):
-        super(PollGraph, self).__init__()
-        self.setLabel('left', 'Dust concn', 'pcs/L')
-        self.setLabel('bottom', 'Time', 's')
-        self.addLegend()
-
-        self.setView()
-        self.setDownsampling(mode='peak')
-
-        # Identity
-        self.name = 'Air quality'
-        self.setTitle(self.name)
-
-        self.plotLayout = plotLayout
-        self.chunkSize = 150000
-        self.array = np.empty((self.chunkSize + 1, 2))
-        self.p = 0
-
-        self.ind = 2
-
-        # Vars
-        self.initState = self.saveState()
-        self.maxCurves = max_graph_length
-        self.colour = '#0000ff'
-        self.scale = 'self.pcsL(%s)'
-        self.data = [0, 'pcs/L']
-
-        self.curve = self.plot(pen=self.colour, name=self.name)
+        if channel.mean:
+            self.meanTimer = QtCore.QTimer()
+            self.meanTimer.start(2000)
+            self.mArray = RingBuffer(self.chunkSize, spill=spillPath(channel.name + '-mean'))
+            self.meanStat = 'mean'
+            self.mean = 0
+            self.mCurve = self.plot(pen=pg.mkPen(color=self.colour, style=QtCore.Qt.DotLine), name='Mean ' + self.name)
 
     def start(self):
         # Events
-        Timing.timer.timeout.connect(lambda: update(self))
+        scheduler.sigFrame.connect(lambda: update(self))
+        self.sigXRangeChanged.connect(lambda: viewChanged(self))
+        if self.channel.mean:
+            self.meanTimer.timeout.connect(lambda: meanUpdate(self))
 
     def setView(self):
         self.setXRange(0, delta_s)
-        self.setYRange(0, 40000)
+        self.setYRange(self.yRange[0], self.yRange[1])
         self.showGrid(x=1, y=1, alpha=0.35)
         self.enableAutoRange('x')
 
-    def pcsL(self, inpt):
-        Globals.poll = inpt
-        return inpt
-
-
-# ----------------------------------------------------------------------
-# Obtained
-# ----------------------------------------------------------------------
-def hypsometricFormula(P0):
-    P = float(Globals.press)
-    a = float((P0 / P)**(1 / 5.257) - 1)
-    b = float(Globals.temp)
-    altitude = (a * b) / 0.0065
-    return str(altitude)
+    def paintEvent(self, ev):
+        paint(self, ev)
 
 # ----------------------------------------------------------------------
 # General
 # ----------------------------------------------------------------------
 
 class ControlFrame(QtGui.QTabWidget):
-    def __init__(self):
+    def __init__(self, graphs):
         super(ControlFrame, self).__init__()
         self.graphs = QtGui.QTabWidget()
-        self.controlTemp = ControlTemp()
-        self.controlPressure = ControlPressure()
-        self.controlPoll = ControlPoll()
+        self.controls = [ControlChannel(graph) for graph in graphs]
 
         self.logger = Logger()
+        self.metrics = MetricsView()
 
-        self.graphs.addTab(self.controlTemp, 'Temperature')
-        self.graphs.addTab(self.controlPressure, 'Pressure')
-        self.graphs.addTab(self.controlPoll, 'Air quality')
+        for graph, control in zip(graphs, self.controls):
+            self.graphs.addTab(control, graph.name)
 
         self.addTab(self.graphs, 'Graphs')
         self.addTab(self.logger, 'Debug')
-
-class TableItem(QtGui.QTableWidgetItem):
-    def __init__(self, parent, text, graph=None, u=0, colour=None):
-        super(TableItem, self).__init__()
-        self.setFlags(QtCore.Qt.NoItemFlags)
-
-        if colour == None:
-            colour = QtGui.QBrush((QtGui.QColor(graph.colour)))
-        else:
-            colour = QtGui.QBrush((QtGui.QColor(colour)))
-
-        self.colour = colour
-        self.setForeground(self.colour)
-
-        self.parent  = parent
-        self.text = text
-        self.graph = graph
-
-        if u == 1:
-            self.setText('...')
-            Timing.timer.timeout.connect(self.update)
-        else:
-            self.setText(text)
-
-    def update(self):
-        text = eval(self.text)
-        try:
-            text = float(text)
-        except ValueError:
-            pass
-        if type(text) == float:
-            text = '%.3f' %(text) #np
-        self.setText(unicode(text))
-        self.parent.resizeColumnToContents(2)
-
-class CurrentData(QtGui.QTableWidget):
+        self.addTab(self.metrics, 'Metrics')
+
+def readoutText(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return '----'
+        return '%.3f' %(value) #np
+    return unicode(value)
+
+class ReadoutRow():
+    # One line of the readout: value and unit are called every frame, so
+    # they can read a graph's latest sample or compute a derived quantity
+    def __init__(self, label, value=None, unit=None, colour='#ffffff'):
+        self.label = '  ' + label
+        self.value = value
+        self.unit = unit
+        self.brush = QtGui.QBrush(QtGui.QColor(colour))
+
+    def cells(self):
+        if self.value is None:
+            return [self.label, '----', '----']
+        unit = self.unit() if callable(self.unit) else self.unit
+        return [self.label, readoutText(self.value()), unicode(unit)]
+
+def graphRow(label, graph):
+    return ReadoutRow(label, lambda: graph.data[0], lambda: graph.data[1], graph.colour)
+
+def meanRow(graph):
+    return ReadoutRow('Mean ' + graph.channel.short, lambda: graph.mean, lambda: graph.data[1], graph.colour)
+
+class ReadoutModel(QtCore.QAbstractTableModel):
+    sigWidthChanged = QtCore.Signal(int)
+
+    def __init__(self, rows=()):
+        super(ReadoutModel, self).__init__()
+        self.rows = []
+        self.texts = []
+        self.lengths = [0, 0, 0]
+        for row in rows:
+            self.addRow(row)
+
+    def addRow(self, row):
+        n = len(self.rows)
+        self.beginInsertRows(QtCore.QModelIndex(), n, n)
+        self.rows.append(row)
+        self.texts.append(['...'] * 3 if row.value else row.cells())
+        self.endInsertRows()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else 3
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return self.texts[index.row()][index.column()]
+        if role == QtCore.Qt.ForegroundRole:
+            return self.rows[index.row()].brush
+        return None
+
+    def flags(self, index):
+        return QtCore.Qt.NoItemFlags
+
+    def refresh(self):
+        # One dataChanged covering the rows whose text moved this frame
+        first = last = None
+        for i, row in enumerate(self.rows):
+            if row.value is None:
+                continue
+            cells = row.cells()
+            if cells != self.texts[i]:
+                self.texts[i] = cells
+                first = i if first is None else first
+                last = i
+        if first is None:
+            return
+        self.dataChanged.emit(self.index(first, 0), self.index(last, 2))
+        for column in xrange(3):
+            length = max(len(cells[column]) for cells in self.texts)
+            if length != self.lengths[column]:
+                self.lengths[column] = length
+                self.sigWidthChanged.emit(column)
+
+class CurrentData(QtGui.QTableView):
     def __init__(self, graphs):
         super(CurrentData, self).__init__()
-        self.setRowCount(6)
-        self.setColumnCount(3)
         self.setMaximumWidth(280)
         self.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
         self.verticalHeader().setVisible(False)
         self.horizontalHeader().setVisible(False)
 
-        self.timer = QtCore.QTimer()
-        self.timer.start(100)
-
-        self.setItem(0, 0, TableItem(self, '  Temperature', graphs[0]))
-        self.setItem(0, 1, TableItem(self, 'self.graph.data[0]', graphs[0], 1))
-        self.setItem(0, 2, TableItem(self, 'self.graph.data[1]', graphs[0], 1))
-        self.setItem(1, 0, TableItem(self, '  Pressure', graphs[1]))
-        self.setItem(1, 1, TableItem(self, 'self.graph.data[0]', graphs[1], 1))
-        self.setItem(1, 2, TableItem(self, 'self.graph.data[1]', graphs[1], 1))
-        self.setItem(2, 0, TableItem(self, '  Air quality', graphs[2]))
-        self.setItem(2, 1, TableItem(self, 'self.graph.data[0]', graphs[2], 1))
-        self.setItem(2, 2, TableItem(self, 'self.graph.data[1]', graphs[2], 1))
-        self.setItem(3, 0, TableItem(self, '  Altitude', colour='#ff00ff'))
-        self.setItem(3, 1, TableItem(self, 'hypsometricFormula(101325.0)', graphs[0], 1, colour='#ff00ff'))
-        self.setItem(3, 2, TableItem(self, 'm', colour='#ff00ff'))
-        self.setItem(4, 0, TableItem(self, '  ----', colour='#ffffff'))
-        self.setItem(4, 1, TableItem(self, '----', colour='#ffffff'))
-        self.setItem(4, 2, TableItem(self, '----', colour='#ffffff'))
-        self.setItem(5, 0, TableItem(self, '  Mean T.', graphs[0]))
-        self.setItem(5, 1, TableItem(self, 'self.graph.mean', graphs[0], 1))
-        self.setItem(5, 2, TableItem(self, 'self.graph.data[1]', graphs[0], 1))
+        rows = [graphRow(graph.name, graph) for graph in graphs]
+        rows.append(ReadoutRow('----'))
+        for graph in graphs:
+            if graph.channel.mean:
+                rows.append(meanRow(graph))
+        self.readout = ReadoutModel(rows)
+        self.setModel(self.readout)
+        self.readout.sigWidthChanged.connect(self.resizeColumnToContents)
+
+        scheduler.every(self, lambda view: view.readout.refresh())
+
+    def addRow(self, label, value, unit=None, colour='#ffffff'):
+        self.readout.addRow(ReadoutRow(label, value, unit, colour))
 
 class DataLayout(QtGui.QGridLayout):
     def __init__(self, graphs):
@@ -947,7 +822,7 @@ class DataLayout(QtGui.QGridLayout):
         self.setContentsMargins(0, 0, 0, 0)
 
         self.data = CurrentData(graphs)
-        self.controlFrame = ControlFrame()
+        self.controlFrame = ControlFrame(graphs)
 
         self.addWidget(self.data, 0, 0)
         self.addWidget(self.controlFrame, 0, 1)
@@ -964,31 +839,41 @@ class PlottingLayout(QtGui.QGridLayout):
         self.setSpacing(1)
         self.setContentsMargins(0, 0, 0, 0)
 
-        self.sqlite = SQLite()
+        self.sqlite = SQLite(stream.subscribe())
+        self.sqlite.start()
+        QtCore.QCoreApplication.instance().aboutToQuit.connect(self.finish)
 
+        # Drain the reader before any graph runs on the same frame
+        scheduler.sigFrame.connect(self.acquire)
+        stream.start()
+
+        scheduler.start()
+        Timing.timer.timeout.connect(statusModel.poll)
         Timing.timer.start(100)
         Timing.slowTimer.start(1000)
-        Timing.passiveTimer.start(3000)
-
-        # Graphs
-        self.tempGraph = TempGraph(self)
-        self.pressureGraph = PressureGraph(self)
-        self.pollGraph = PollGraph(self)
-
-        self.dataFrame = DataFrame([self.tempGraph, self.pressureGraph, self.pollGraph])
 
-        self.addWidget(self.tempGraph, 0, 0)
-        self.addWidget(self.pressureGraph, 0, 1)
-        self.addWidget(self.pollGraph, 1, 0)
-        self.addWidget(self.dataFrame, 1, 1)
-
-        self.startTimerTemp = QtCore.QTimer.singleShot(1000, self.tempGraph.start)
-        self.startTimerPress = QtCore.QTimer.singleShot(1000, self.pressureGraph.start)
-        self.startTimerPoll = QtCore.QTimer.singleShot(1000, self.pollGraph.start)
-        Timing.slowTimer.timeout.connect(self.sqliteRecord)
-
-    def sqliteRecord(self):
-        self.sqlite.addRecords()
+        # Graphs, two to a row with the data frame in the next free cell
+        self.graphs = [ChannelGraph(self, channel) for channel in registry]
+        self.dataFrame = DataFrame(self.graphs)
+
+        for i, graph in enumerate(self.graphs):
+            self.addWidget(graph, i // 2, i % 2)
+            QtCore.QTimer.singleShot(1000, graph.start)
+        n = len(self.graphs)
+        self.addWidget(self.dataFrame, n // 2, n % 2)
+
+    def acquire(self):
+        stream.drain()
+        if stream.fresh:
+            setGlobals(stream.latest[stream.primary])
+        for event in alarms.update(stream):
+            self.sqlite.alarm(event)
+
+    def finish(self):
+        # The last drain hands the writer whatever the readers queued
+        stream.stop()
+        stream.drain()
+        self.sqlite.stop()
 
 class PlottingFrame(QtGui.QWidget):
     def __init__(self):
@@ -1026,9 +911,20 @@ class MainWindow(QtGui.QMainWindow):
         self.show()
 
 if __name__ == '__main__':
+    try:
+        setup(sys.argv[1:])
+    except ValueError as e:
+        print e
+        sys.exit(1)
     app = QtGui.QApplication(sys.argv)
     app.setStyle(QtGui.QStyleFactory.create('Fusion'))
     app.setApplicationName('8SpaceDataProcessor V.%s' %VERSION)
 
+    log.open()
+    app.aboutToQuit.connect(log.close)
+    server = serveMetrics(options)
+    if server is not None:
+        app.aboutToQuit.connect(server.stop)
+
     window = MainWindow()
     sys.exit(app.exec_())
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Rebuilds recorded samples from the raw journal after a crash. Samples
+# of a run that never reached the database are appended to the session
+# that was recording it; runs with no session get a new one.
+#
+#     python recover.py [--journal DIR] [--db FILE] [--source NAME] [--run RUN] [--full] [--p0 PA]
+import sys
+import argparse
+from core import *
+
+def parseOptions(argv):
+    parser = argparse.ArgumentParser(prog='recover')
+    parser.add_argument('--journal', metavar='DIR', default=journal_dir, help='journal directory')
+    parser.add_argument('--db', default=db_path, help='database to rebuild')
+    parser.add_argument('--source', help='device the journal belongs to, when several were recording')
+    parser.add_argument('--run', type=int, action='append', help='only this run (repeatable)')
+    parser.add_argument('--full', action='store_true', help='write every run into a new session')
+    parser.add_argument('--p0', type=float, default=p0, help='reference pressure for the altitude, Pa')
+    return parser.parse_args(argv)
+
+def findSession(c, first, last, source):
+    # The session whose samples overlap the run, and its last sample
+    where = 't >= ? AND t <= ?'
+    params = [first, last]
+    if source is not None:
+        where += ' AND session IN (SELECT id FROM sessions WHERE source = ?)'
+        params.append(source)
+    row = c.execute('SELECT session FROM samples WHERE %s '
+                    'GROUP BY session ORDER BY COUNT(*) DESC LIMIT 1' %(where), params).fetchone()
+    if row is None:
+        return None, None
+    return row[0], c.execute('SELECT MAX(t) FROM samples WHERE session = ?', row).fetchone()[0]
+
+def recoverRun(conn, segments, full, source):
+    c = conn.cursor()
+    first = last = None
+    for t, line in readJournal(segments):
+        first = t if first is None else first
+        last = t
+    if first is None:
+        return 0
+    first = int(first * 1000000)
+    last = int(last * 1000000)
+
+    session, after = (None, None) if full else findSession(c, first, last, source)
+    if session is None:
+        c.execute('INSERT INTO sessions(started, version, source) VALUES (?, ?, ?)', (first, 'journal', source))
+        session = c.lastrowid
+        after = first - 1
+
+    convert = [channel.storing() for channel in registry]
+    insert = insertSamples()
+    pipeline = DerivedPipeline()
+    def store(samples):
+        t = [sample[0] for sample in samples]
+        frames = pipeline.compute(np.array(t) / 1000000.0, [sample[1] for sample in samples])
+        columns = [f(column).tolist() for f, column in zip(convert, frames.T)]
+        c.executemany(insert, zip([session] * len(t), t, *columns))
+        return len(t)
+
+    samples = []
+    written = 0
+    replay = Replay(segments[0], speed=0)
+    replay.open()
+    for now, data in replay.samples:
+        t = int(now * 1000000)
+        if t <= after:
+            continue
+        after = t
+        samples.append((t, data))
+        if len(samples) >= 10000:
+            written += store(samples)
+            samples = []
+    if samples:
+        written += store(samples)
+    conn.commit()
+    return written
+
+def main(argv):
+    options = parseOptions(argv)
+    setP0(options.p0)
+    setEstimate()
+    runs = journalRuns(options.journal)
+    if options.run:
+        runs = dict([(run, runs[run]) for run in options.run if run in runs])
+    if not runs:
+        print 'No journal runs in %s' %(options.journal)
+        return
+
+    conn = sqlite3.connect(options.db)
+    createSchema(conn.cursor())
+    migrateRecords(conn)
+    conn.commit()
+    for run in sorted(runs):
+        written = recoverRun(conn, runs[run], options.full, options.source)
+        print 'Run %d: %d segment(s), %d sample(s) recovered' %(run, len(runs[run]), written)
+    conn.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Works the derived channels of a recorded session out again from its
+# sensor columns, e.g. with another reference pressure or filter tuning,
+# and writes them back into the database in chunks.
+#
+#     python rederive.py [--db FILE] [--session ID] [--p0 PA] [--sigma-alt M] [--sigma-accel MS2]
+import sys
+import argparse
+from core import *
+
+def parseOptions(argv):
+    parser = argparse.ArgumentParser(prog='rederive')
+    parser.add_argument('--db', default=db_path, help='database to update')
+    parser.add_argument('--session', type=int, help='session id, the last one by default')
+    parser.add_argument('--p0', type=float, default=p0, help='reference pressure for the altitude, Pa')
+    parser.add_argument('--sigma-alt', type=float, help='altitude noise of the estimate, m')
+    parser.add_argument('--sigma-accel', type=float, help='unmodelled acceleration of the estimate, m/s2')
+    return parser.parse_args(argv)
+
+def rederive(records, session, size=10000):
+    store = [(channelNames().index(channel.name), channel.storing()) for channel in derived]
+    update = 'UPDATE samples SET %s WHERE session = ? AND t = ?' \
+        %(', '.join(['%s = ?' %(channel.name) for channel in derived]))
+
+    pipeline = DerivedPipeline()
+    written = 0
+    for t, data in records.sensorChunks(session, size):
+        frames = pipeline.compute(t / 1000000.0, data)
+        rows = [f(frames[:, i]).tolist() for i, f in store]
+        records.conn.executemany(update, zip(*(rows + [[session] * len(t), t.tolist()])))
+        written += len(t)
+    records.conn.commit()
+    return written
+
+def main(argv):
+    options = parseOptions(argv)
+    setP0(options.p0)
+    setEstimate(options.sigma_alt, options.sigma_accel)
+
+    records = Records(options.db, writable=True)
+    # Columns for channels registered since the session was recorded
+    createSchema(records.conn.cursor())
+    session = options.session
+    if session is None:
+        session = records.lastSession()
+    written = rederive(records, session)
+    records.close()
+    print 'Session %s: %d sample(s) updated' %(session, written)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
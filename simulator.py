@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Simulated CanSat Arduino on a Linux pseudo-terminal. It writes the same
+# 'temp,press,poll' CSV lines as the board (BMP180 temperature in C and
+# pressure in hPa, PPD42NS dust concentration in pcs/L) so parsing,
+# reconnects and storage can be load-tested without hardware:
+#
+#     python simulator.py --rate 1000 --malformed 0.01 &
+#     python main.py --port /tmp/ttyCANSAT
+import os
+import sys
+import pty
+import tty
+import time
+import math
+import errno
+import fcntl
+import random
+import argparse
+
+link_path = '/tmp/ttyCANSAT'
+downtime = 2.0
+
+class Sensors():
+    def __init__(self, noise=1.0):
+        self.noise = noise
+        self.temp = 20.0
+        self.press = 1013.25
+        self.poll = 1200.0
+
+    def read(self, t):
+        # Slow drifts plus sensor noise, with the BMP180 output resolution
+        self.press += random.gauss(0, 0.002) - 0.0005 * (self.press - 1013.25)
+        temp = self.temp + 0.5 * math.sin(t / 300.0) + random.gauss(0, 0.05 * self.noise)
+        press = self.press + random.gauss(0, 0.03 * self.noise)
+        self.poll = max(0.0, self.poll + random.gauss(0, 20 * self.noise) - 0.01 * (self.poll - 1200.0))
+        poll = self.poll
+        if random.random() < 0.002 * self.noise:
+            poll *= random.uniform(3, 10)
+        return '%.1f,%.2f,%.2f' %(temp, press, poll)
+
+def malformedLine(line):
+    kind = random.randint(0, 3)
+    if kind == 0:
+        return line[:random.randint(0, len(line) - 1)]
+    if kind == 1:
+        fields = line.split(',')
+        fields[random.randint(0, 2)] = ''
+        return ','.join(fields)
+    if kind == 2:
+        return line.replace('.', 'x', 1)
+    return ''.join([chr(random.randint(33, 126)) for x in xrange(random.randint(1, 20))])
+
+class Simulator():
+    def __init__(self, options):
+        self.options = options
+        self.sensors = Sensors(options.noise)
+        self.master = None
+        self.slave = None
+        self.sent = 0
+        self.dropped = 0
+        self.malformed = 0
+
+    def open(self):
+        self.master, self.slave = pty.openpty()
+        # Raw mode so the line discipline neither echoes nor rewrites lines
+        tty.setraw(self.slave)
+        setNonBlocking(self.master)
+        name = os.ttyname(self.slave)
+        if os.path.lexists(self.options.link):
+            os.remove(self.options.link)
+        os.symlink(name, self.options.link)
+        print 'Simulating on %s (%s)' %(self.options.link, name)
+
+    def close(self):
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = None
+        self.slave = None
+
+    def write(self, lines):
+        data = ''.join(lines)
+        try:
+            os.write(self.master, data)
+            self.sent += len(lines)
+        except OSError as e:
+            # Like a real UART, nobody reading means the lines are lost
+            if e.errno not in (errno.EAGAIN, errno.EIO):
+                raise
+            self.dropped += len(lines)
+
+    def line(self, t):
+        line = self.sensors.read(t)
+        if random.random() < self.options.malformed:
+            line = malformedLine(line)
+            self.malformed += 1
+        return line + '\r\n'
+
+    def run(self):
+        options = self.options
+        period = 1.0 / options.rate
+        start = time.time()
+        next = start
+        gapUntil = 0
+        disconnectAt = self.nextDisconnect(start)
+        lastReport = start
+
+        self.open()
+        while options.duration <= 0 or time.time() - start < options.duration:
+            now = time.time()
+
+            if now >= disconnectAt:
+                print 'Disconnected'
+                self.close()
+                time.sleep(downtime)
+                self.open()
+                now = time.time()
+                next = now
+                disconnectAt = self.nextDisconnect(now)
+
+            # Every line that is due, so kHz rates go out in a few writes
+            lines = []
+            while next <= now:
+                if next >= gapUntil:
+                    if random.random() < options.dropout * period:
+                        gapUntil = next + random.uniform(0.5, 3.0)
+                    else:
+                        lines.append(self.line(next - start))
+                next += period
+            if lines:
+                self.write(lines)
+
+            if now - lastReport >= 10:
+                print '%d sent, %d malformed, %d dropped' %(self.sent, self.malformed, self.dropped)
+                sys.stdout.flush()
+                lastReport = now
+            time.sleep(max(0.0, min(next - time.time(), 0.01)))
+        self.close()
+
+    def nextDisconnect(self, now):
+        if self.options.disconnect <= 0:
+            return float('inf')
+        return now + random.expovariate(1.0 / self.options.disconnect)
+
+def setNonBlocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+def parseOptions(argv):
+    parser = argparse.ArgumentParser(prog='simulator')
+    parser.add_argument('--rate', type=float, default=10.0, help='lines per second')
+    parser.add_argument('--noise', type=float, default=1.0, help='noise scale, 0 for clean signals')
+    parser.add_argument('--dropout', type=float, default=0.0, help='silent gaps per second')
+    parser.add_argument('--malformed', type=float, default=0.0, help='fraction of malformed lines')
+    parser.add_argument('--disconnect', type=float, default=0.0, help='mean seconds between disconnects, 0 for never')
+    parser.add_argument('--duration', type=float, default=0.0, help='seconds to run, 0 for ever')
+    parser.add_argument('--link', default=link_path, help='symlink pointing at the current pty')
+    parser.add_argument('--seed', type=int, help='random seed')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    options = parseOptions(sys.argv[1:])
+    if options.seed is not None:
+        random.seed(options.seed)
+    simulator = Simulator(options)
+    try:
+        simulator.run()
+    except KeyboardInterrupt:
+        simulator.close()
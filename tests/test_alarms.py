@@ -0,0 +1,72 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from core import Rule
+
+def transitions(rule, t, v, bounds):
+    # Feeds the rule in batches split at `bounds`; transitions come back
+    # with indices into the whole series
+    found = []
+    edges = [0] + list(bounds) + [len(t)]
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi > lo:
+            found += [(lo + i, raised, x) for i, raised, x in rule.evaluate(t[lo:hi], v[lo:hi])]
+    return found
+
+class RuleSplitTest(unittest.TestCase):
+    # A rule must report the same transitions however the stream is batched
+
+    def series(self):
+        t = np.arange(2000) * 0.01
+        v = 10 * np.sin(t * 1.3) + np.random.RandomState(1).normal(0, 1, len(t))
+        return t, v
+
+    def check(self, **options):
+        t, v = self.series()
+        whole = transitions(Rule('r', 'x', **options), t, v, [])
+        self.assertTrue(whole)
+        rng = np.random.RandomState(2)
+        for splits in ([1000], [1, 2, 3], range(0, len(t), 7), sorted(rng.choice(len(t), 40, replace=False))):
+            split = transitions(Rule('r', 'x', **options), t, v, splits)
+            self.assertEqual([(i, raised) for i, raised, x in split], [(i, raised) for i, raised, x in whole])
+            np.testing.assert_allclose([x for i, raised, x in split], [x for i, raised, x in whole], rtol=1e-9)
+
+    def test_threshold(self):
+        self.check(above=5.0)
+
+    def test_hysteresis_and_sustain(self):
+        self.check(above=5.0, below=-8.0, hysteresis=1.5, sustain=0.3)
+
+    def test_rate(self):
+        self.check(above=8.0, rate=True, window=0.5, hysteresis=2.0, sustain=0.1)
+
+    def test_state_carries_over(self):
+        rule = Rule('r', 'x', above=1.0, sustain=0.5)
+        self.assertEqual(rule.evaluate(np.array([0.0, 0.2]), np.array([2.0, 2.0])), [])
+        self.assertEqual(rule.evaluate(np.array([0.4, 0.6]), np.array([2.0, 2.0])), [(1, True, 2.0)])
+        self.assertEqual(rule.evaluate(np.array([0.8]), np.array([0.5])), [(0, False, 0.5)])
+
+class RuleMissingTest(unittest.TestCase):
+    # NaN fields neither trip nor clear a rule
+
+    def test_threshold(self):
+        rule = Rule('r', 'x', above=1.0)
+        t = np.arange(6.0)
+        self.assertEqual(rule.evaluate(t, np.array([np.nan, 2.0, np.nan, np.nan, 0.0, np.nan])),
+                         [(1, True, 2.0), (4, False, 0.0)])
+        self.assertEqual(rule.value, 0.0)
+
+    def test_rate(self):
+        rule = Rule('r', 'x', above=5.0, rate=True, window=1.0)
+        t = np.arange(40) * 0.1
+        v = t * 2.0
+        v[::3] = np.nan
+        self.assertEqual(rule.evaluate(t, v), [])
+        self.assertAlmostEqual(rule.value, 2.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from core import AltitudeFilter
+
+def runSplit(t, z, a, bounds):
+    # Feeds one filter in chunks split at `bounds` and joins the output
+    f = AltitudeFilter()
+    edges = [0] + list(bounds) + [len(t)]
+    parts = [f.run(t[lo:hi], z[lo:hi], None if a is None else a[lo:hi])
+             for lo, hi in zip(edges[:-1], edges[1:]) if hi > lo]
+    return [np.concatenate(column) for column in zip(*parts)]
+
+class AltitudeFilterSplitTest(unittest.TestCase):
+    # The estimate must not depend on how the session is chunked
+
+    def flight(self):
+        rng = np.random.RandomState(3)
+        t = np.cumsum(rng.uniform(0.005, 0.015, 3000))
+        a = np.where(t < 5, 20.0, -9.81) + rng.normal(0, 0.5, len(t))
+        truth = np.cumsum(np.cumsum(a * np.diff(np.concatenate(([0], t)))) * np.diff(np.concatenate(([0], t))))
+        z = truth + rng.normal(0, 1.0, len(t))
+        # Outliers the gate rejects, and a run long enough to restart
+        z[500] += 200
+        z[1500:1530] += 300
+        return t, z, a
+
+    def check(self, useAccel):
+        t, z, a = self.flight()
+        a = a if useAccel else None
+        whole = runSplit(t, z, a, [])
+        rng = np.random.RandomState(4)
+        for splits in ([1500], [1, 2, 3], range(0, len(t), 11), sorted(rng.choice(len(t), 50, replace=False))):
+            for expected, got in zip(whole, runSplit(t, z, a, splits)):
+                np.testing.assert_array_equal(got, expected)
+
+    def test_barometer_only(self):
+        self.check(False)
+
+    def test_with_acceleration(self):
+        self.check(True)
+
+    def test_gate_and_restart(self):
+        t, z, a = self.flight()
+        h, v, sigma = AltitudeFilter(restart=20).run(t, z, a)
+        self.assertLess(abs(h[500] - z[499]), 50)
+        self.assertLess(abs(h[1529] - z[1529]), 5)
+
+class AltitudeFilterMissingTest(unittest.TestCase):
+
+    def test_missing_altitude(self):
+        # Missing readings only carry the prediction forward
+        t = np.arange(200) * 0.1
+        z = 100.0 - 5.0 * t
+        z[50:60] = np.nan
+        h, v, sigma = AltitudeFilter().run(t, z)
+        self.assertTrue(np.isfinite(h).all())
+        self.assertLess(abs(h[59] - (100.0 - 5.0 * t[59])), 1.0)
+        self.assertGreater(sigma[59], sigma[49])
+        self.assertLess(abs(v[-1] + 5.0), 0.5)
+
+    def test_missing_first(self):
+        h, v, sigma = AltitudeFilter().run([0.0, 0.1, 0.2], [np.nan, 10.0, 10.0], [0.0, np.nan, 0.0])
+        self.assertTrue(np.isnan(h[0]))
+        self.assertEqual(h[1], 10.0)
+        self.assertTrue(np.isfinite(h[1:]).all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from core import Journal, journal_header, journal_record, journalRuns, readJournal
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.lines = [(100.0 + i, 'line %d,1,2,3' %(i)) for i in range(50)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, close=True, segmentSize=4096):
+        journal = Journal(self.directory, segmentSize=segmentSize, syncInterval=1e9)
+        for t, line in self.lines:
+            journal.append(t, line)
+        if close:
+            journal.close()
+        else:
+            journal.sync()
+        return journal
+
+    def segments(self):
+        return journalRuns(self.directory).values()[0]
+
+    def offset(self, index):
+        # Byte offset of record `index` in the first segment
+        return journal_header.size + sum(journal_record.size + len(line) for t, line in self.lines[:index])
+
+    def test_round_trip(self):
+        self.write(segmentSize=512)
+        self.assertGreater(len(self.segments()), 1)
+        self.assertEqual(list(readJournal(self.segments())), self.lines)
+
+    def test_blank_lines(self):
+        # Blank serial lines are records too, not the end of the segment
+        self.lines[10:10] = [(109.5, ''), (109.7, '')]
+        self.lines.append((200.0, ''))
+        journal = self.write(close=False)
+        self.assertEqual(list(readJournal(self.segments())), self.lines)
+        journal.close()
+        self.assertEqual(list(readJournal(self.segments())), self.lines)
+
+    def test_preallocated_tail(self):
+        # A crashed writer leaves the segment at full size, zero-filled
+        journal = self.write(close=False)
+        self.assertEqual(os.path.getsize(self.segments()[0]), 4096)
+        self.assertEqual(list(readJournal(self.segments())), self.lines)
+        journal.close()
+
+    def test_torn_tail(self):
+        self.write()
+        path = self.segments()[0]
+        with open(path, 'r+b') as f:
+            f.truncate(self.offset(40) + journal_record.size + 3)
+        self.assertEqual(list(readJournal([path])), self.lines[:40])
+
+    def test_bad_crc(self):
+        self.write()
+        path = self.segments()[0]
+        with open(path, 'r+b') as f:
+            f.seek(self.offset(20) + journal_record.size)
+            byte = f.read(1)
+            f.seek(-1, 1)
+            f.write(chr(ord(byte) ^ 0xff))
+        self.assertEqual(list(readJournal([path])), self.lines[:20])
+
+    def test_bad_time(self):
+        # The receive time is covered by the checksum too
+        self.write()
+        path = self.segments()[0]
+        with open(path, 'r+b') as f:
+            f.seek(self.offset(30) + 8)
+            f.write('\x00' * 8)
+        self.assertEqual(list(readJournal([path])), self.lines[:30])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import collections
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from core import ChannelStats, SlidingWindow
+
+class SlidingWindowTest(unittest.TestCase):
+    # Batches of any size must give the same window as single pushes
+
+    def test_batches(self):
+        rng = np.random.RandomState(5)
+        x = np.round(rng.normal(size=5000), 1)
+        for size in (1, 7, 600):
+            window = SlidingWindow(size)
+            recent = collections.deque(maxlen=size)
+            pos = 0
+            while pos < len(x):
+                batch = x[pos:pos + rng.randint(1, 2 * size + 2)]
+                pos += len(batch)
+                window.extend(batch)
+                recent.extend(batch)
+                self.assertEqual(window.min(), min(recent))
+                self.assertEqual(window.max(), max(recent))
+                self.assertAlmostEqual(window.mean(), np.mean(recent), 9)
+
+class ChannelStatsTest(unittest.TestCase):
+
+    def test_quantiles(self):
+        stats = ChannelStats(quantiles=True)
+        stats.extend(np.arange(1000.0))
+        self.assertAlmostEqual(stats.value('median'), 499.5, delta=5)
+        self.assertAlmostEqual(stats.value('iqm'), 499.5, delta=5)
+        self.assertRaises(KeyError, ChannelStats().value, 'iqm')
+
+class ChannelStatsMissingTest(unittest.TestCase):
+
+    def test_nan_is_skipped(self):
+        stats = ChannelStats(quantiles=True)
+        stats.extend([1.0, np.nan, 3.0, np.inf])
+        for name in ('mean', 'ewma', 'wmean', 'wmin', 'wmax', 'median', 'iqm', 'std'):
+            self.assertTrue(np.isfinite(stats.value(name)), name)
+        self.assertEqual(stats.value('mean'), 2.0)
+        self.assertEqual(stats.value('wmax'), 3.0)
+
+if __name__ == '__main__':
+    unittest.main()